@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+    Prints the query plans of the lookups backed by the composite indexes
+    of the event table, against a seeded database.
+
+        python -m benchmarks.plans --rules 50 --singles 1000
+
+    SQLite plans are read with EXPLAIN QUERY PLAN, other backends with EXPLAIN.
+"""
+import argparse
+import datetime
+import os
+
+import django
+
+#name -> (factory of the queryset, columns of the index it should use)
+QUERIES = {}
+
+def query(*columns):
+    def register(func):
+        QUERIES[func.__name__] = (func, list(columns))
+        return func
+    return register
+
+@query('rule_id', 'cancelled')
+def group_sources(start):
+    from scheduler.models import Event
+    rules = Event.objects.exclude(rule=None).values_list('rule', flat=True).distinct()
+    return Event.objects.filter(rule__in=rules, cancelled=None)
+
+@query('rule_id', 'start')
+def exceptions_window(start):
+    from django.db.models import Q
+    from scheduler.models import Event
+    end = start + datetime.timedelta(days=31)
+    return Event.objects.filter(
+        Q(end__gte=start, start__lte=end) | Q(original_end__gte=start, original_start__lte=end), rule=1
+    ).exclude(cancelled=None)
+
+@query('rule_id', 'original_start')
+def exceptions_window_original(start):
+    #both branches of the OR are searched by index.
+    return exceptions_window(start)
+
+@query('rule_id', 'start')
+def single_events(start):
+    from scheduler.models import Event
+    return Event.objects.filter(rule=None, end__gt=start).order_by('start', 'pk')
+
+@query('calendar_id', 'end')
+def calendar_events(start):
+    from scheduler.models import Event
+    return Event.objects.filter(calendar=1, end__gt=start)
+
+def query_plan(queryset):
+    from django.db import connections
+    connection = connections[queryset.db]
+    sql, params = queryset.query.sql_with_params()
+    explain = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    with connection.cursor() as cursor:
+        cursor.execute(explain + sql, params)
+        return [' '.join(str(column) for column in row[-1:]) for row in cursor.fetchall()]
+
+def index_names(model, using='default'):
+    #columns -> name of the index.
+    from django.db import connections
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return dict((tuple(info['columns']), name) for name, info in constraints.items() if info['index'])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Prints query plans of the indexed event lookups.")
+    parser.add_argument('--calendars', type=int, default=5)
+    parser.add_argument('--rules', type=int, default=50)
+    parser.add_argument('--exceptions', type=int, default=200)
+    parser.add_argument('--singles', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+    django.setup()
+    from django.db import connection
+    from benchmarks.seed import seed
+    from scheduler.models import Event
+
+    connection.creation.create_test_db(verbosity=0)
+    start = seed(calendars=args.calendars, rules=args.rules, exceptions=args.exceptions, singles=args.singles)
+    indexes = index_names(Event)
+    for name, (factory, columns) in sorted(QUERIES.items()):
+        plan = query_plan(factory(start))
+        index = indexes.get(tuple(columns))
+        print("%s (%s: %s)" %(name, ', '.join(columns), "used" if any(index in line for line in plan) else "NOT USED"))
+        for line in plan:
+            print("    %s" %line)
+
+if __name__ == "__main__":
+    main()
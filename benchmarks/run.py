@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+    Times the occurrence hot paths against a seeded in-memory SQLite database.
+
+        python -m benchmarks.run --rules 50 --singles 1000 --output results.json
+        python -m benchmarks.run --compare results.json
+
+    Every benchmark reports the best of *repeat* wall clock timings and the
+    number of queries of one run. Results are written as JSON, together with
+    the seeding parameters and the current git commit.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import django
+
+BENCHMARKS = []
+
+def benchmark(func):
+    BENCHMARKS.append(func)
+    return func
+
+@benchmark
+def event_get_occurrences(start):
+    from scheduler.models import Event
+    event = Event.objects.source_events().exclude(rule=None).order_by('pk')[0]
+    return lambda: event.get_occurrences(start, start + datetime.timedelta(days=365))
+
+@benchmark
+def queryset_occurrences_after(start):
+    from scheduler.models import Event
+    return lambda: list(itertools.islice(Event.objects.all().occurrences_after(start), 1000))
+
+@benchmark
+def period_occurrences(start):
+    from scheduler.models import Event
+    from scheduler.periods import Period
+    return lambda: Period(Event.objects.source_events(), start, start + datetime.timedelta(days=31)).occurrences
+
+@benchmark
+def month_weeks_days(start):
+    from scheduler.models import Event
+    from scheduler.periods import Month
+    def render():
+        month = Month(Event.objects.source_events(), start)
+        return [[day.occurrences for day in week.get_days] for week in month.get_weeks]
+    return render
+
+def measure(factory, start, repeat):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from scheduler.models.rules import rrule_cache
+
+    func = factory(start)
+    timings = []
+    for i in range(repeat):
+        rrule_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            begin = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - begin)
+    return {
+        'seconds': min(timings),
+        'queries': len(queries),
+    }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline):
+    for name, result in sorted(results['benchmarks'].items()):
+        old = baseline['benchmarks'].get(name)
+        if old is None:
+            print("%-28s %10.4fs %6i queries (new)" %(name, result['seconds'], result['queries']))
+            continue
+        print("%-28s %10.4fs %6i queries  %6.2fx time, %+i queries" %(
+            name, result['seconds'], result['queries'],
+            result['seconds'] / old['seconds'] if old['seconds'] else float('inf'),
+            result['queries'] - old['queries'],
+        ))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks occurrence expansion and period rendering.")
+    parser.add_argument('--calendars', type=int, default=5)
+    parser.add_argument('--rules', type=int, default=50)
+    parser.add_argument('--exceptions', type=int, default=200)
+    parser.add_argument('--singles', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', action='append', help="run only the named benchmark, may be given multiple times")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare with")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.test_settings')
+    django.setup()
+    from django.db import connection
+    from benchmarks.seed import seed
+
+    connection.creation.create_test_db(verbosity=0)
+    seed_params = {
+        'calendars': args.calendars,
+        'rules': args.rules,
+        'exceptions': args.exceptions,
+        'singles': args.singles,
+    }
+    start = seed(**seed_params)
+
+    results = {
+        'commit': git_commit(),
+        'python': sys.version.split()[0],
+        'django': django.get_version(),
+        'seed': seed_params,
+        'repeat': args.repeat,
+        'benchmarks': {},
+    }
+    for factory in BENCHMARKS:
+        if args.only and factory.__name__ not in args.only:
+            continue
+        results['benchmarks'][factory.__name__] = measure(factory, start, args.repeat)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    else:
+        compare(results, {'benchmarks': {}})
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+import datetime
+import random
+
+from django.utils import timezone
+
+from scheduler.models import Event, Rule, Calendar
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY")
+
+def seed(calendars=5, rules=50, exceptions=200, singles=1000, start=None, days=365, random_seed=0):
+    """
+        Fills the database with a reproducible set of events:
+        *rules* recurring events and *singles* one-off events within *days*
+        after start, spread over *calendars*, and *exceptions* moved or
+        cancelled occurrences of the recurring events.
+    """
+    rand = random.Random(random_seed)
+    if start is None:
+        start = datetime.datetime(2016, 1, 4, 0, 0, tzinfo=timezone.utc)
+
+    calendar_list = [Calendar.objects.create(name="Calendar %i" %i, slug="calendar-%i" %i) for i in range(calendars)]
+
+    def random_slot():
+        slot_start = start + datetime.timedelta(days=rand.randrange(days), hours=rand.randrange(8, 18))
+        return slot_start, slot_start + datetime.timedelta(minutes=rand.choice((30, 60, 90)))
+
+    sources = []
+    for i in range(rules):
+        rule = Rule.objects.create(name="Rule %i" %i, frequency=FREQUENCIES[i % len(FREQUENCIES)])
+        slot_start, slot_end = random_slot()
+        sources.append(Event.objects.create(
+            start=slot_start - datetime.timedelta(days=slot_start.day),
+            end=slot_end - datetime.timedelta(days=slot_start.day),
+            rule=rule,
+            calendar=rand.choice(calendar_list),
+        ))
+
+    for i in range(exceptions if sources else 0):
+        source = rand.choice(sources)
+        occurrence = next(source.occurrences_after(start + datetime.timedelta(days=rand.randrange(days))))
+        if rand.random() < 0.5:
+            occurrence.cancel()
+        else:
+            occurrence.move(occurrence.start + datetime.timedelta(hours=rand.randrange(1, 4)))
+
+    singles_list = []
+    for i in range(singles):
+        slot_start, slot_end = random_slot()
+        singles_list.append(Event(start=slot_start, end=slot_end, calendar=rand.choice(calendar_list)))
+    for event in singles_list:
+        event.save()
+
+    return start
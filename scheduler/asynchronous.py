@@ -0,0 +1,77 @@
+import asyncio
+import functools
+
+from django.db import close_old_connections
+
+#The ORM of this django version is synchronous only. Async counterparts of
+#the occurrence API run their queries in the default executor of the event
+#loop, independent queries are sent concurrently from different threads.
+#Every executor thread uses its own database connection.
+
+def run_in_thread(func, *args, **kwargs):
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(None, functools.partial(_with_connection, func, *args, **kwargs))
+
+def _with_connection(func, *args, **kwargs):
+    #Like a request: broken connections and those older than CONN_MAX_AGE
+    #are closed before and after, executor threads don't keep them forever.
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+class AsyncIterator(object):
+    """
+        Asynchronous iterator over a synchronous one, advanced in the executor
+        *batch_size* items at a time. *start* is a coroutine function
+        returning the synchronous iterator. Consumers stopping early close it
+        with aclose() or by using the iterator as async context manager.
+    """
+    def __init__(self, start, batch_size=100):
+        self.start = start
+        self.batch_size = batch_size
+        self._iterator = None
+        self._batch = []
+        self._exhausted = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._batch:
+            if self._exhausted:
+                raise StopAsyncIteration
+            if self._iterator is None:
+                self._iterator = iter(await self.start())
+            self._batch = await run_in_thread(self._next_batch)
+            if not self._batch:
+                raise StopAsyncIteration
+        return self._batch.pop()
+
+    def _next_batch(self):
+        batch = []
+        for item in self._iterator:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+        else:
+            self._exhausted = True
+        #popped from the end.
+        batch.reverse()
+        return batch
+
+    async def aclose(self):
+        #closes generators and the querysets they are reading.
+        self._batch = []
+        self._exhausted = True
+        iterator, self._iterator = self._iterator, None
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await run_in_thread(close)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
@@ -0,0 +1,198 @@
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+
+from django.db.models.signals import post_save, post_delete
+from django.utils import timezone
+
+from scheduler.models import Event, Rule, Occurrence
+
+logger = logging.getLogger(__name__)
+
+#Upcoming occurrences within the lookahead are kept in a heap ordered by start.
+#Saving or deleting an event, exception or rule only recomputes the occurrences
+#of its group: its heap entries are invalidated by bumping the group's
+#generation and skipped once they surface.
+
+class Dispatcher(object):
+    """
+        Calls the registered handlers with every occurrence of *events*
+        (default: all events) once it starts. Cancelled occurrences are skipped.
+        Occurrences are loaded *lookahead* ahead of time.
+    """
+
+    def __init__(self, events=None, lookahead=datetime.timedelta(hours=1)):
+        self.events = events
+        self.lookahead = lookahead
+        self.handlers = []
+        self.cursor = None
+        self.horizon = None
+        self._heap = []
+        self._generations = {}
+        self._counter = itertools.count()
+        self._changed = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def register(self, handler):
+        #returns the handler, may be used as decorator.
+        self.handlers.append(handler)
+        return handler
+
+    def connect(self):
+        post_save.connect(self._receive, dispatch_uid=self._uid('save'))
+        post_delete.connect(self._receive, dispatch_uid=self._uid('delete'))
+
+    def disconnect(self):
+        post_save.disconnect(dispatch_uid=self._uid('save'))
+        post_delete.disconnect(dispatch_uid=self._uid('delete'))
+
+    def _uid(self, signal):
+        return 'scheduler.dispatcher.%s.%i' %(signal, id(self))
+
+    def _receive(self, sender, instance, raw=False, **kwargs):
+        #may be sent from other threads, the groups are refreshed by the dispatching one.
+        if raw:
+            return
+        if isinstance(instance, Rule):
+            key = ('rule', instance.pk)
+        elif isinstance(instance, Event):
+            key = _group_key(instance)
+        else:
+            return
+        with self._lock:
+            self._changed.add(key)
+        self._wakeup.set()
+
+    def get_events(self):
+        if self.events is None:
+            return Event.objects.all()
+        return self.events.all()
+
+    def refresh(self, now=None):
+        """
+            Reloads all occurrences starting after *now* within the lookahead.
+        """
+        if now is None:
+            now = timezone.now()
+        self.cursor = now
+        self._reload(now + self.lookahead)
+
+    def _reload(self, horizon):
+        with self._lock:
+            self._changed.clear()
+        self.horizon = horizon
+        self._heap = []
+        self._generations = {}
+        self._push(self.get_events())
+
+    def refresh_group(self, key):
+        kind, pk = key
+        self._generations[key] = self._generations.get(key, 0) + 1
+        if kind == 'rule':
+            events = self.get_events().filter(rule=pk)
+        else:
+            events = self.get_events().filter(pk=pk, rule=None)
+        self._push(events, key)
+
+    def _push(self, events, key=None):
+        for occurrence in events.occurrences_after(self.cursor):
+            if occurrence.start > self.horizon:
+                break
+            if occurrence.start <= self.cursor or occurrence.cancelled:
+                continue
+            occurrence_key = key or _group_key(occurrence)
+            heapq.heappush(self._heap, (
+                occurrence.start, next(self._counter),
+                occurrence_key, self._generations.get(occurrence_key, 0), occurrence,
+            ))
+
+    def _apply_changes(self):
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        for key in changed:
+            self.refresh_group(key)
+
+    def _discard_stale(self):
+        while self._heap:
+            start, counter, key, generation, occurrence = self._heap[0]
+            if generation == self._generations.get(key, 0):
+                return
+            heapq.heappop(self._heap)
+
+    def next_due(self):
+        """
+            Returns the start of the next occurrence to dispatch, or None.
+        """
+        self._apply_changes()
+        self._discard_stale()
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def dispatch_due(self, now=None):
+        """
+            Calls the handlers with every occurrence that started until *now*
+            and was not dispatched yet. Returns the dispatched occurrences.
+        """
+        if now is None:
+            now = timezone.now()
+        if self.horizon is None:
+            self.refresh(now)
+        elif now >= self.horizon:
+            #occurrences between the cursor and now are still due.
+            self._reload(now + self.lookahead)
+        self._apply_changes()
+
+        dispatched = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now:
+                break
+            occurrence = heapq.heappop(self._heap)[-1]
+            self._dispatch(occurrence)
+            dispatched.append(occurrence)
+
+        self.cursor = max(self.cursor, now)
+        return dispatched
+
+    def _dispatch(self, occurrence):
+        for handler in self.handlers:
+            try:
+                handler(occurrence)
+            except Exception:
+                logger.exception("Handler %r failed for occurrence %r", handler, occurrence)
+
+    def run(self, max_wait=60):
+        """
+            Dispatches occurrences until stop() is called, sleeping
+            until the next occurrence is due or an event changes.
+        """
+        self._stopped.clear()
+        self.connect()
+        try:
+            while not self._stopped.is_set():
+                self._wakeup.clear()
+                self.dispatch_due()
+                wait = max_wait
+                for when in (self.next_due(), self.horizon):
+                    if when is not None:
+                        wait = min(wait, (when - timezone.now()).total_seconds())
+                self._wakeup.wait(max(wait, 0))
+        finally:
+            self.disconnect()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+def _group_key(event):
+    #generated occurrences have no pk of their own.
+    if event.rule_id:
+        return ('rule', event.rule_id)
+    if isinstance(event, Occurrence):
+        event = event.source
+    return ('event', event.pk)
@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+# -*- coding: utf-8 -*-
+
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from django.db.models import Q
+
+from scheduler.models import Event, Rule
+from scheduler.models.occurrences import OccurrenceColumns
+
+#Expanding rules is CPU bound. expand_calendars() loads everything it needs
+#with three queries, describes it as plain, picklable tuples and expands
+#the calendars in worker processes that never touch the database.
+
+SourceDescriptor = namedtuple('SourceDescriptor', [
+    'pk', 'start', 'end', 'original_start',
+    'rule', 'frequency', 'params', 'start_recurring_period', 'end_recurring_period',
+])
+ExceptionDescriptor = namedtuple('ExceptionDescriptor', [
+    'pk', 'start', 'end', 'original_start', 'original_end', 'cancelled',
+])
+
+def expand_calendars(calendars, start, end, workers=None):
+    """
+        Returns an OrderedDict mapping the pk of every calendar in *calendars*
+        (instances or pks) to OccurrenceColumns of its occurrences between start and end.
+        Calendars are expanded by *workers* processes (default: number of CPUs),
+        0 expands them in this process.
+    """
+    calendar_pks = [getattr(calendar, 'pk', calendar) for calendar in calendars]
+    shards = _describe(calendar_pks, start, end)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    expanded = {}
+    if workers and len(shards) > 1:
+        #a few shards per worker even out calendars of different size.
+        count = min(len(shards), workers * 4)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_expand, [shards[i::count] for i in range(count)], [start] * count, [end] * count)
+            for result in results:
+                expanded.update(result)
+    else:
+        expanded.update(_expand(shards, start, end))
+    return OrderedDict((pk, expanded.get(pk) or OccurrenceColumns()) for pk in calendar_pks)
+
+def _describe(calendar_pks, start, end):
+    sources = Event.objects.filter(
+        calendar__in=calendar_pks, cancelled=None
+    ).exclude(rule=None).exclude(rule__end_recurring_period__lt=start).select_related('rule').without_leaf_classes()
+    shards = OrderedDict((pk, ([], [])) for pk in calendar_pks)
+    rule_sources = {}
+    for source in sources:
+        rule = source.rule
+        descriptor = SourceDescriptor(
+            source.pk, source.start, source.end, source.original_start,
+            rule.pk, rule.frequency, rule.params, rule.start_recurring_period, rule.end_recurring_period,
+        )
+        shards[source.calendar_id][0].append((descriptor, rule_sources.setdefault(rule.pk, [])))
+
+    exceptions = Event.objects.filter(
+        Q(end__gte=start, start__lte=end) | Q(original_end__gte=start, original_start__lte=end),
+        rule__in=list(rule_sources),
+    ).exclude(cancelled=None).values_list('rule', 'pk', 'start', 'end', 'original_start', 'original_end', 'cancelled')
+    for exception in exceptions:
+        rule_sources[exception[0]].append(ExceptionDescriptor(*exception[1:]))
+
+    singles = Event.objects.filter(
+        calendar__in=calendar_pks, rule=None, start__lt=end, end__gt=start
+    ).values_list('calendar', 'pk', 'start', 'end', 'cancelled')
+    for single in singles:
+        shards[single[0]][1].append(single[1:])
+
+    return [(pk, sources, singles) for pk, (sources, singles) in shards.items()]
+
+def _expand(shards, start, end):
+    #runs in worker processes, which may have to set up django first.
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        django.setup()
+
+    expanded = []
+    for calendar_pk, sources, singles in shards:
+        columns = OccurrenceColumns()
+        for source, exceptions in sources:
+            rule = Rule(
+                pk=source.rule, frequency=source.frequency, params=source.params,
+                start_recurring_period=source.start_recurring_period,
+                end_recurring_period=source.end_recurring_period,
+            )
+            event = Event(pk=source.pk, start=source.start, end=source.end, original_start=source.original_start, rule=rule)
+            event.add_occurrence_columns(columns, start, end, [Event(**exception._asdict()) for exception in exceptions])
+        for pk, single_start, single_end, cancelled in singles:
+            columns.append(pk, single_start, single_end, cancelled, pk)
+        expanded.append((calendar_pk, columns.sort()))
+    return expanded
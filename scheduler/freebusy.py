@@ -0,0 +1,75 @@
+from __future__ import unicode_literals
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+from django.db.models import Q
+
+from scheduler.models import Event
+from scheduler.models.occurrences import to_epoch, from_epoch
+
+#Free/busy times are computed from OccurrenceColumns, no occurrence
+#or event instances are created for generated occurrences and singular events.
+#Busy intervals are clipped to the requested window, cancelled occurrences
+#are free. All times have a precision of whole seconds.
+
+FreeBusy = namedtuple('FreeBusy', ['busy', 'free'])
+
+def get_free_busy(events, start, end):
+    """
+        Returns merged busy intervals and free gaps of *events*,
+        a queryset of events, between start and end.
+    """
+    columns = events.occurrence_columns(start, end)
+    busy = _sweep(columns, to_epoch(start), to_epoch(end)).get(None, [])
+    return _free_busy(busy, start, end)
+
+def get_calendar_free_busy(calendars, start, end):
+    """
+        Returns a dict mapping the pk of every calendar to its FreeBusy between start and end.
+        Takes five queries, regardless of the number of calendars.
+    """
+    calendar_pks = [getattr(calendar, 'pk', calendar) for calendar in calendars]
+    events = Event.objects.filter(calendar__in=calendar_pks)
+    columns = events.occurrence_columns(start, end)
+    #occurrences are assigned to the calendar of their source.
+    calendar_of = dict(events.filter(
+        Q(rule=None, start__lt=end, end__gt=start) | (Q(cancelled=None) & ~Q(rule=None))
+    ).values_list('pk', 'calendar'))
+    keys = [calendar_of.get(source) for source in columns.source]
+    busy = _sweep(columns, to_epoch(start), to_epoch(end), keys)
+    return dict(
+        (pk, _free_busy(busy.get(pk, []), start, end))
+        for pk in calendar_pks
+    )
+
+def _sweep(columns, window_start, window_end, keys=None):
+    #Columns are ordered by start, every group only has to
+    #remember the interval it is currently extending.
+    busy = {}
+    for i in range(len(columns)):
+        if columns.cancelled[i]:
+            continue
+        start = max(columns.start[i], window_start)
+        end = min(columns.end[i], window_end)
+        if start >= end:
+            continue
+        intervals = busy.setdefault(None if keys is None else keys[i], [])
+        if intervals and start <= intervals[-1][1]:
+            if end > intervals[-1][1]:
+                intervals[-1][1] = end
+        else:
+            intervals.append([start, end])
+    return busy
+
+def _free_busy(busy, start, end):
+    naive = start.tzinfo is None
+    busy = [(from_epoch(busy_start, naive), from_epoch(busy_end, naive)) for busy_start, busy_end in busy]
+    free = []
+    last = start
+    for busy_start, busy_end in busy:
+        if busy_start > last:
+            free.append((last, busy_start))
+        last = busy_end
+    if last < end:
+        free.append((last, end))
+    return FreeBusy(busy, free)
@@ -0,0 +1,180 @@
+import datetime
+
+from django.db.models.query import prefetch_related_objects
+from django.utils import timezone
+
+from scheduler.models import Event
+
+#Exports events as iCalendar (RFC 5545) without expanding rules:
+#every source-event becomes one VEVENT with an RRULE, cancelled
+#occurrences become EXDATEs and other persisted exceptions VEVENTs
+#overriding their RECURRENCE-ID. Events are read in chunks, the
+#export is produced one VEVENT at a time.
+
+ICAL_PARAMS = (
+    ('interval', 'INTERVAL'),
+    ('count', 'COUNT'),
+    ('bysecond', 'BYSECOND'),
+    ('byminute', 'BYMINUTE'),
+    ('byhour', 'BYHOUR'),
+    ('byweekday', 'BYDAY'),
+    ('bymonthday', 'BYMONTHDAY'),
+    ('byyearday', 'BYYEARDAY'),
+    ('byweekno', 'BYWEEKNO'),
+    ('bymonth', 'BYMONTH'),
+    ('bysetpos', 'BYSETPOS'),
+    ('wkst', 'WKST'),
+)
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+def iter_icalendar(events, properties=None, domain='django-essential-scheduler', chunk_size=100):
+    """
+        Yields *events* (a queryset) as iCalendar text, one VEVENT at a time.
+        *properties* is called with every exported event and returns
+        additional (name, text) pairs, e.g. [('SUMMARY', event.title)].
+        UIDs are made of the pk of the source-event and *domain*.
+    """
+    stamp = _format_datetime(datetime.datetime.now(timezone.utc))
+    yield _lines([
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//django-essential-scheduler//EN',
+    ])
+
+    for rules in _chunks(events.exclude(rule=None).values_list('rule', flat=True).distinct(), 'rule', chunk_size):
+        exceptions = {}
+        for exception in Event.objects.filter(rule__in=rules).exclude(cancelled=None).order_by('original_start', 'pk'):
+            exceptions.setdefault(exception.rule_id, []).append(exception)
+        #sources of the rule outside of *events* aren't exported.
+        sources = list(events.filter(rule__in=rules, cancelled=None).order_by('rule', 'pk'))
+        prefetch_related_objects(sources, ['rule'])
+        for source, source_exceptions in _assign_exceptions(sources, exceptions):
+            yield _source_vevent(source, source_exceptions, properties, domain, stamp)
+
+    for singles in _chunks(events.filter(rule=None), 'pk', chunk_size):
+        for event in singles:
+            lines = _vevent_lines(event, event.start, event.end, properties, domain, stamp)
+            if event.cancelled:
+                lines.insert(-1, 'STATUS:CANCELLED')
+            yield _lines(lines)
+
+    yield _lines(['END:VCALENDAR'])
+
+def write_icalendar(events, file, **kwargs):
+    """
+        Writes *events* as iCalendar to the text file *file*, see iter_icalendar().
+    """
+    for chunk in iter_icalendar(events, **kwargs):
+        file.write(chunk)
+
+def get_rrule(rule):
+    """
+        Returns the RRULE value of *rule*.
+        Raises ValueError for params without iCalendar counterpart.
+    """
+    params = rule.get_params()
+    unknown = set(params) - set(name for name, ical_name in ICAL_PARAMS)
+    if unknown:
+        raise ValueError("Rule %s can't be exported, unsupported params: %s" %(rule.pk, ', '.join(sorted(unknown))))
+    parts = ['FREQ=%s' %rule.frequency]
+    for name, ical_name in ICAL_PARAMS:
+        if name not in params:
+            continue
+        values = params[name] if isinstance(params[name], list) else [params[name]]
+        if name in ('byweekday', 'wkst'):
+            values = [WEEKDAYS[value] for value in values]
+        parts.append('%s=%s' %(ical_name, ','.join(str(value) for value in values)))
+    #COUNT and UNTIL mustn't both be given, the count is kept.
+    if rule.end_recurring_period and 'count' not in params:
+        parts.append('UNTIL=%s' %_format_datetime(rule.end_recurring_period))
+    return ';'.join(parts)
+
+def _chunks(queryset, key, chunk_size):
+    #keyset pagination, never more than one chunk in memory.
+    last = None
+    while True:
+        chunk = queryset.order_by(key)
+        if last is not None:
+            chunk = chunk.filter(**{'%s__gt' %key: last})
+        chunk = list(chunk[:chunk_size])
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1] if key == 'rule' else chunk[-1].pk
+
+def _assign_exceptions(sources, exceptions):
+    #exceptions replace the occurrence of the source-event with their original duration.
+    assigned = dict((source.pk, []) for source in sources)
+    first_sources = {}
+    by_duration = {}
+    for source in sources:
+        first_sources.setdefault(source.rule_id, source)
+        by_duration.setdefault((source.rule_id, source.duration), source)
+    for rule_pk, rule_exceptions in exceptions.items():
+        for exception in rule_exceptions:
+            duration = exception.original_end - exception.original_start
+            source = by_duration.get((rule_pk, duration), first_sources.get(rule_pk))
+            if source is not None:
+                assigned[source.pk].append(exception)
+    return [(source, assigned[source.pk]) for source in sources]
+
+def _source_vevent(source, exceptions, properties, domain, stamp):
+    start = source.get_rrule_start()
+    lines = _vevent_lines(source, start, start + source.duration, properties, domain, stamp)
+    extra = ['RRULE:%s' %get_rrule(source.rule)]
+    cancelled = [exception.original_start for exception in exceptions if exception.cancelled]
+    if cancelled:
+        extra.append('EXDATE:%s' %','.join(_format_datetime(when) for when in cancelled))
+    lines[-1:-1] = extra
+
+    for exception in exceptions:
+        if exception.cancelled:
+            continue
+        override = _vevent_lines(exception, exception.start, exception.end, properties, domain, stamp, uid_event=source)
+        override.insert(-1, 'RECURRENCE-ID:%s' %_format_datetime(exception.original_start))
+        lines.extend(override)
+    return _lines(lines)
+
+def _vevent_lines(event, start, end, properties, domain, stamp, uid_event=None):
+    lines = [
+        'BEGIN:VEVENT',
+        'UID:%i@%s' %((uid_event or event).pk, domain),
+        'DTSTAMP:%s' %stamp,
+        'DTSTART:%s' %_format_datetime(start),
+        'DTEND:%s' %_format_datetime(end),
+    ]
+    if properties is not None:
+        lines.extend('%s:%s' %(name, _escape(value)) for name, value in properties(event))
+    lines.append('END:VEVENT')
+    return lines
+
+def _format_datetime(value):
+    #aware datetimes are exported in UTC, naive ones as floating time.
+    if timezone.is_aware(value):
+        return value.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return value.strftime('%Y%m%dT%H%M%S')
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def _lines(lines):
+    return ''.join(_fold(line) + '\r\n' for line in lines)
+
+def _fold(line):
+    #lines are limited to 75 octets, continuation lines start with a space.
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line
+    parts = []
+    limit = 75
+    while len(encoded) > limit:
+        cut = limit
+        #never split a multi-byte character.
+        while cut > 0 and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+        limit = 74
+    parts.append(encoded.decode('utf-8'))
+    return '\r\n '.join(parts)
@@ -0,0 +1,154 @@
+import time
+
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.backends.utils import CursorWrapper, CursorDebugWrapper
+from django.dispatch import Signal
+
+#Sent once a hot path finished, with a Measurement as keyword argument:
+#
+#   @receiver(hot_path)
+#   def log_hot_path(sender, measurement, **kwargs):
+#       logger.info("%s took %.4fs", measurement.name, measurement.duration)
+#
+#Without receivers, nothing is measured at all.
+hot_path = Signal(providing_args=['measurement'])
+
+class QueryCounter(object):
+    #counts the queries of the connection, independent of its query log.
+    def execute(self, sql, params=None):
+        self.db.scheduler_query_count += 1
+        return super(QueryCounter, self).execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.db.scheduler_query_count += 1
+        return super(QueryCounter, self).executemany(sql, param_list)
+
+class CountingCursorWrapper(QueryCounter, CursorWrapper):
+    pass
+
+class CountingCursorDebugWrapper(QueryCounter, CursorDebugWrapper):
+    pass
+
+CURSOR_FACTORIES = ('make_cursor', 'make_debug_cursor')
+
+def count_queries(connection):
+    """
+        Makes new cursors of *connection* count their queries in
+        connection.scheduler_query_count, until uncount_queries()
+        was called as often as count_queries().
+    """
+    if not getattr(connection, 'scheduler_counting', 0):
+        if not hasattr(connection, 'scheduler_query_count'):
+            connection.scheduler_query_count = 0
+        #factories set on the connection itself are restored, others are inherited again.
+        connection.scheduler_saved_factories = dict(
+            (name, vars(connection)[name]) for name in CURSOR_FACTORIES if name in vars(connection)
+        )
+        connection.make_cursor = lambda cursor: CountingCursorWrapper(cursor, connection)
+        connection.make_debug_cursor = lambda cursor: CountingCursorDebugWrapper(cursor, connection)
+    connection.scheduler_counting = getattr(connection, 'scheduler_counting', 0) + 1
+    return connection
+
+def uncount_queries(connection):
+    connection.scheduler_counting -= 1
+    if not connection.scheduler_counting:
+        saved = connection.scheduler_saved_factories
+        for name in CURSOR_FACTORIES:
+            if name in saved:
+                setattr(connection, name, saved[name])
+            else:
+                delattr(connection, name)
+        del connection.scheduler_saved_factories
+
+def get_alias(instance):
+    #querysets know their database, model instances their state.
+    alias = getattr(instance, 'db', None)
+    if not isinstance(alias, str):
+        alias = getattr(getattr(instance, '_state', None), 'db', None)
+    return alias or DEFAULT_DB_ALIAS
+
+class Measurement(object):
+    """
+        Duration and number of queries of one run of a hot path.
+        *generated* counts occurrences computed from rules,
+        *replaced* those swapped for persisted exceptions.
+    """
+
+    def __init__(self, name, sender, instance=None):
+        self.name = name
+        self.sender = sender
+        self.instance = instance
+        self.duration = 0.0
+        self.queries = 0
+        self.generated = 0
+        self.replaced = 0
+        self.using = get_alias(instance)
+
+    def __enter__(self):
+        self._resume()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._pause()
+        self.send()
+
+    def _resume(self):
+        #connections are thread local, looked up on every resume.
+        self._connection = count_queries(connections[self.using])
+        self._queries = self._connection.scheduler_query_count
+        self._started = time.perf_counter()
+
+    def _pause(self):
+        self.duration += time.perf_counter() - self._started
+        self.queries += self._connection.scheduler_query_count - self._queries
+        uncount_queries(self._connection)
+
+    def iterate(self, iterable):
+        #Only time spent producing items is measured, the signal
+        #is sent once the generator is exhausted or closed.
+        iterator = iter(iterable)
+        try:
+            while True:
+                self._resume()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    self._pause()
+                yield item
+        finally:
+            self.send()
+
+    def send(self):
+        hot_path.send(sender=self.sender, measurement=self)
+
+class NullMeasurement(object):
+    #Shared by all hot paths while nobody listens, ignores everything.
+    name = None
+    sender = None
+    instance = None
+    using = None
+    duration = 0.0
+    queries = 0
+    generated = 0
+    replaced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def __setattr__(self, attr, value):
+        pass
+
+    def iterate(self, iterable):
+        return iterable
+
+null_measurement = NullMeasurement()
+
+def measure(name, sender, instance=None):
+    if not hot_path.receivers:
+        return null_measurement
+    return Measurement(name, sender, instance)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from scheduler.models import Event
+
+class Command(BaseCommand):
+    help = "Stores the next occurrence of all source events whose stored next occurrence has started or was never computed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', dest='all', default=False,
+            help="Recompute the next occurrence of all source events.")
+
+    def handle(self, *args, **options):
+        events = Event.objects.source_events() if options['all'] else None
+        events = Event.objects.update_next_occurrences(events)
+        self.stdout.write("Updated the next occurrence of %i events." %len(events))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from scheduler.models import MaterializedOccurrence
+from scheduler.settings import settings
+
+class Command(BaseCommand):
+    help = "Stores the occurrences of all events within the next MATERIALIZATION_DAYS, dropping rows that already ended."
+
+    def handle(self, *args, **options):
+        rows = MaterializedOccurrence.objects.refresh()
+        self.stdout.write("Materialized %i occurrences for the next %i days." %(len(rows), settings.MATERIALIZATION_DAYS))
@@ -1,3 +1,4 @@
 from scheduler.models.calendars import Calendar, CalendarRelation
 from scheduler.models.events import *
-from scheduler.models.rules import *
\ No newline at end of file
+from scheduler.models.rules import *
+from scheduler.models.materialized import MaterializedOccurrence
@@ -64,6 +64,13 @@ class Calendar(with_metaclass(models.base.ModelBase, *get_model_bases())):
     def occurrences_after(self, after=None):
         return self.events.all().occurrences_after(after)
 
+    def get_conflicts(self, start, end):
+        """
+            Returns all pairs of overlapping occurrences between start and end.
+        """
+        from scheduler.periods import Period
+        return Period(self.events.source_events(), start, end).get_conflicts()
+
     def create_relation(self, obj, distinction=None):
         return CalendarRelation.objects.create_relation(self, obj, distinction)
 
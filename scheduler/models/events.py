@@ -3,19 +3,35 @@ from django.utils.six.moves.builtins import str
 from django.utils.six import with_metaclass
 # -*- coding: utf-8 -*-
 
+import asyncio
+import base64
+import binascii
+import bisect
 import heapq
-from dateutil import rrule
+import operator
+from datetime import timedelta
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.query import prefetch_related_objects
+from django.db.models.signals import post_save
+from django.dispatch import receiver
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import python_2_unicode_compatible 
 from django.utils.formats import date_format
 from django.contrib.contenttypes import fields
 from django.contrib.contenttypes.models import ContentType
 
 from scheduler.settings import settings
+from scheduler.instrumentation import measure
+from scheduler.asynchronous import run_in_thread, AsyncIterator
 from scheduler.models.utils import NextOccurrenceReplacer, OccurrenceReplacer, get_model_bases, SubclassingQuerySet
 from scheduler.models.rules import Rule
 from scheduler.models.calendars import Calendar
+from scheduler.models.occurrences import Occurrence, OccurrenceColumns, to_epoch, from_epoch
+
+#fields deciding whether an event may overlap others, see Event.get_conflicts()
+CONFLICT_FIELDS = ('start', 'end', 'rule_id', 'calendar_id', 'cancelled')
 
 SLUG_DATE_FORMAT='%Y-%m-%d-%H-%M%z'
 if not settings.USE_TZ:
@@ -42,8 +58,8 @@ class EventListQuerySet(SubclassingQuerySet):
 
     #Need to override private method _clone, in order to
     #keep track of slug!
-    def _clone(self):
-        clone = super(EventListQuerySet, self)._clone()
+    def _clone(self, **kwargs):
+        clone = super(EventListQuerySet, self)._clone(**kwargs)
         if hasattr(self, 'slug'):
             clone.slug = self.slug
         return clone
@@ -73,57 +89,273 @@ class EventListQuerySet(SubclassingQuerySet):
                 kwargs.setdefault('start', when)
         return super(EventListQuerySet, self).exclude(*args, **kwargs)
 
-    def occurrences_after(self, after=None, tzinfo=timezone.utc):
+    def aoccurrences_after(self, after=None, tzinfo=timezone.utc, chunk_size=100):
+        """
+            Asynchronous iterator version of occurrences_after().
+            Source events and exceptions are loaded concurrently.
+        """
         if after is None:
             after = timezone.now()
-        #NEED TO FILTER FOR SORCE-EVENT!
-        group_events = self.model.objects.filter(
-            rule__in=self.values_list('rule', flat=True).distinct(),
-            cancelled=None, original_start=None, original_end=None
+
+        async def start():
+            group_events, exceptions = await asyncio.gather(
+                run_in_thread(self._get_group_sources, after),
+                run_in_thread(self._get_exceptions_after, after),
+            )
+            return self.occurrences_after(after, tzinfo, chunk_size, group_events, exceptions)
+        return AsyncIterator(start)
+
+    def occurrences_after(self, after=None, tzinfo=timezone.utc, chunk_size=100, group_events=None, exceptions=None):
+        measurement = measure('occurrences_after', type(self), self)
+        return measurement.iterate(self._occurrences_after(after, tzinfo, chunk_size, measurement, group_events, exceptions))
+
+    def _get_group_sources(self, after):
+        rules = self.exclude(rule=None).values_list('rule', flat=True).distinct()
+        group_events = list(self.model.objects.filter(
+            rule__in=rules, cancelled=None
         ).exclude(
             rule__end_recurring_period__lte=after
-        )
-        occ_replacer = NextOccurrenceReplacer(self.exclude(
-                cancelled=None, original_start=None, original_end=None
-        ))
-        source_events = self.filter(
-            rule=None, end__gt=after
-        )
-        #This is a little hacky:
-        #The second for is used ONLY as an assignment!
-        #(By using this expression, just one loop is required!)
-        occurrences = [
-            (next(generator), generator)
+        ).order_by('pk'))
+        prefetch_related_objects(group_events, ['rule'])
+        return group_events
+
+    def _get_exceptions_after(self, after):
+        #exceptions moved to before after still replace their occurrence,
+        #but are not returned.
+        rules = self.exclude(rule=None).values_list('rule', flat=True).distinct()
+        return list(self.model.objects.filter(
+            models.Q(end__gt=after) | models.Q(original_end__gt=after),
+            rule__in=rules
+        ).exclude(cancelled=None).order_by('start', 'pk'))
+
+    def _occurrences_after(self, after, tzinfo, chunk_size, measurement, group_events=None, exceptions=None):
+        if after is None:
+            after = timezone.now()
+        if group_events is None:
+            group_events = self._get_group_sources(after)
+        if exceptions is None:
+            exceptions = self._get_exceptions_after(after)
+        occ_replacer = NextOccurrenceReplacer(exceptions)
+
+        streams = [
+            event_group._occurrences_after_generator(after, running=True)
             for event_group in group_events
-            # generator = event_group._occurrences_after_generator(after)
-            for generator in [
-                event_group._occurrences_after_generator(after)
-            ]
-        ]
-        #Taking care of rule=None events.
-        occurrences += [
-            (next(generator), generator)
-            for event in self.filter(rule=None)
-            # generator = event_group._occurrences_after_generator(after)
-            for generator in [
-                event._occurrences_after_generator(after)
-            ]
         ]
-        heapq.heapify(occurrences)
-
-        while True:
-            if len(occurrences) == 0:
-                raise StopIteration
+        #Taking care of rule=None events, all of them in a single ordered stream.
+        streams.append(self._single_occurrences_after(after, chunk_size))
 
-            generator = occurrences[0][1]
+        #The rank keeps ties in a stable order and
+        #prevents occurrences from being compared.
+        occurrences = []
+        for rank, generator in enumerate(streams):
+            for occurrence in generator:
+                occurrences.append((occurrence.start, rank, occurrence, generator))
+                break
+        heapq.heapify(occurrences)
 
+        while occurrences:
+            start, rank, next_occurence, generator = occurrences[0]
             try:
-                next_occurence = heapq.heapreplace(occurrences, (next(generator), generator))[0]
+                occurrence = next(generator)
+                heapq.heapreplace(occurrences, (occurrence.start, rank, occurrence, generator))
             except StopIteration:
-                next_occurence = heapq.heappop(occurrences)[0]
+                heapq.heappop(occurrences)
+            measurement.generated += 1
+            if occ_replacer.is_replaced(next_occurence):
+                measurement.replaced += 1
             for occ in occ_replacer.get_next_occurrences(next_occurence):
+                if occ.end > after:
+                    yield occ
+
+        for occ in reversed(occ_replacer.remaining_occurrences()):
+            if occ.end > after:
                 yield occ
 
+    def occurrences_between(self, start, end, limit=None, cursor=None):
+        """
+            Returns a list of at most *limit* occurrences overlapping start and end,
+            ordered by start, and a cursor to pass in for the next page.
+            The cursor is None once all occurrences were returned.
+        """
+        after, skip = start, 0
+        if cursor is not None:
+            after, skip = _decode_cursor(cursor)
+        occurrences = []
+        #position of the last occurrence among those with the same start.
+        last_start, position = after, skip
+        for occurrence in self.occurrences_after(after):
+            if occurrence.start >= end:
+                break
+            if occurrence.end <= start:
+                continue
+            #everything before the cursor was returned already.
+            if cursor is not None and occurrence.start < after:
+                continue
+            if occurrence.start == after and skip:
+                skip -= 1
+                continue
+            if limit is not None and len(occurrences) >= limit:
+                return occurrences, _encode_cursor(last_start, position)
+            if occurrence.start == last_start:
+                position += 1
+            else:
+                last_start, position = occurrence.start, 1
+            occurrences.append(occurrence)
+        return occurrences, None
+
+    def occurrence_columns(self, start, end):
+        """
+            Returns the occurrences of all matched events between start and end
+            as OccurrenceColumns, ordered by start.
+            Only persisted exceptions are loaded as model instances.
+        """
+        columns = OccurrenceColumns()
+        rules = self.exclude(rule=None).values_list('rule', flat=True).distinct()
+        #sources of the rules outside of the matched events aren't expanded.
+        sources = list(self.filter(
+            rule__in=rules, cancelled=None
+        ).without_leaf_classes().order_by('pk'))
+        prefetch_related_objects(sources, ['rule'])
+
+        persisted = {}
+        exceptions = self.model.objects.filter(
+            models.Q(end__gte=start, start__lte=end) | models.Q(original_end__gte=start, original_start__lte=end),
+            rule__in=rules
+        ).exclude(cancelled=None).without_leaf_classes()
+        for exception in exceptions:
+            persisted.setdefault(exception.rule_id, []).append(exception)
+        for source in sources:
+            source.add_occurrence_columns(columns, start, end, persisted.get(source.rule_id, []))
+
+        singles = self.filter(rule=None, start__lt=end, end__gt=start).values_list('pk', 'start', 'end', 'cancelled')
+        for pk, single_start, single_end, cancelled in singles:
+            columns.append(pk, single_start, single_end, cancelled, pk)
+        return columns.sort()
+
+    def cancel_occurrences(self, start, end):
+        """
+            Cancels every occurrence of the matched events starting between start
+            and end (exclusive). Returns the number of cancelled occurrences.
+        """
+        return self._change_occurrences(start, end, cancel=True)
+
+    def shift_occurrences(self, start, end, delta):
+        """
+            Moves every occurrence of the matched events starting between start
+            and end (exclusive) by the timedelta delta. Returns the number of moved occurrences.
+        """
+        return self._change_occurrences(start, end, delta=delta)
+
+    def _change_occurrences(self, start, end, cancel=False, delta=None):
+        #Exceptions are created for generated occurrences in bulk. Persisted
+        #exceptions and singular events are cancelled with a single update,
+        #but moved one at a time: sqlite can't add durations to datetimes.
+        rules = self.exclude(rule=None).values_list('rule', flat=True).distinct()
+        sources = list(self.model.objects.filter(rule__in=rules, cancelled=None).order_by('pk'))
+        prefetch_related_objects(sources, ['rule'])
+        persisted = {}
+        for exception in self.model.objects.filter(
+            models.Q(end__gte=start, start__lte=end) | models.Q(original_end__gte=start, original_start__lte=end),
+            rule__in=rules
+        ).exclude(cancelled=None).without_leaf_classes():
+            persisted.setdefault(exception.rule_id, []).append(exception)
+
+        new_exceptions = []
+        existing = []
+        changed_rules = set()
+        for source in sources:
+            for occurrence in source.get_occurrences(start, end, persisted.get(source.rule_id, [])):
+                if not start <= occurrence.start < end or (cancel and occurrence.cancelled):
+                    continue
+                changed_rules.add(source.rule_id)
+                if isinstance(occurrence, Event):
+                    existing.append((occurrence.pk, occurrence.start, occurrence.end))
+                    continue
+                exception = occurrence.as_event()
+                exception.start, exception.end = occurrence.start, occurrence.end
+                exception.cancelled = occurrence.cancelled
+                if cancel:
+                    exception.cancelled = True
+                else:
+                    exception.start += delta
+                    exception.end += delta
+                new_exceptions.append(exception)
+
+        singles = self.filter(rule=None, start__gte=start, start__lt=end)
+        if cancel:
+            singles = singles.exclude(cancelled=True)
+        singles = list(singles.values_list('pk', 'start', 'end'))
+        existing += singles
+
+        #bulk_create() can't insert multi-table inherited subclasses.
+        Event.objects.bulk_create_events([event for event in new_exceptions if type(event) is Event])
+        for event in new_exceptions:
+            if type(event) is not Event:
+                event.save()
+        if cancel and existing:
+            Event.objects.filter(pk__in=[pk for pk, old_start, old_end in existing]).update(cancelled=True)
+        elif not cancel:
+            for pk, old_start, old_end in existing:
+                Event.objects.filter(pk=pk).update(start=old_start + delta, end=old_end + delta)
+
+        #no signals are sent by bulk operations.
+        if settings.MATERIALIZE_OCCURRENCES or settings.TRACK_NEXT_OCCURRENCES:
+            changed = [source for source in sources if source.rule_id in changed_rules]
+            changed += list(Event.objects.filter(pk__in=[pk for pk, old_start, old_end in singles]))
+            if settings.MATERIALIZE_OCCURRENCES:
+                from scheduler.models.materialized import MaterializedOccurrence
+                MaterializedOccurrence.objects.refresh(changed)
+            if settings.TRACK_NEXT_OCCURRENCES:
+                Event.objects.update_next_occurrences(changed)
+        if not settings.TRACK_NEXT_OCCURRENCES and (changed_rules or singles):
+            #recomputed by the next update_next_occurrences().
+            changed_pks = [source.pk for source in sources if source.rule_id in changed_rules]
+            changed_pks += [pk for pk, old_start, old_end in singles]
+            Event.objects.filter(pk__in=changed_pks).update(next_occurrence_checked=None)
+        return len(new_exceptions) + len(existing)
+
+    def _single_occurrences_after(self, after, chunk_size):
+        #Streams events without rule ordered by start, chunk by chunk.
+        #Keyset pagination on (start, pk) never reads more than one chunk ahead.
+        events = self.filter(rule=None, end__gt=after).order_by('start', 'pk')
+        last = None
+        while True:
+            chunk = events
+            if last is not None:
+                chunk = chunk.filter(models.Q(start__gt=last.start) | models.Q(start=last.start, pk__gt=last.pk))
+            chunk = list(chunk[:chunk_size])
+            for event in chunk:
+                occurrence = event._create_occurrence(event.start, event.end)
+                #singular events are cancelled themselves.
+                occurrence.cancelled = bool(event.cancelled)
+                yield occurrence
+            if len(chunk) < chunk_size:
+                return
+            last = chunk[-1]
+
+def _encode_cursor(start, position):
+    return base64.urlsafe_b64encode(('%s|%i' %(start.isoformat(), position)).encode('ascii')).decode('ascii')
+
+def _decode_cursor(cursor):
+    try:
+        start, position = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii').split('|')
+        start = parse_datetime(start)
+        position = int(position)
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise ValueError("Invalid cursor %r" %cursor)
+    if start is None:
+        raise ValueError("Invalid cursor %r" %cursor)
+    return start, position
+
+class OccurrenceConflict(ValidationError):
+    """
+        Raised by Event.save() with PREVENT_CONFLICTS enabled,
+        *conflicts* are the overlapping occurrences.
+    """
+    def __init__(self, conflicts):
+        self.conflicts = conflicts
+        super(OccurrenceConflict, self).__init__("Overlaps %i occurrence(s) of the calendar." %len(conflicts), code='conflict')
+
 from datetime import datetime
 class EventManager(models.Manager):
 
@@ -139,12 +371,120 @@ class EventManager(models.Manager):
     def get_for_object(self, content_object, distinction=None):
         return EventRelation.objects.get_events_for_object(content_object, distinction, self)
 
+    def prepare_group_sources(self, events):
+        """
+            Initializes new recurring events before they are saved:
+            The first source-event of a rule defines the rule's start_recurring_period
+            and it's own original start and end.
+            Requires one query for all events, regardless of their number.
+        """
+        sources = [event for event in events if event.cancelled is None and event.rule is not None]
+        rule_pks = set(event.rule.pk for event in sources if event.rule.pk is not None)
+        if rule_pks:
+            existing = set(self.filter(rule__in=rule_pks, cancelled=None).values_list('rule', flat=True))
+        else:
+            existing = set()
+
+        changed_rules = []
+        for event in sources:
+            rule = event.rule
+            #unsaved rules can only be told apart by identity.
+            key = rule.pk if rule.pk is not None else id(rule)
+            if key in existing:
+                continue
+            existing.add(key)
+            if event.original_start is None:
+                event.original_start = event.start
+            if event.original_end is None:
+                event.original_end = event.end
+            if not rule.start_recurring_period:
+                rule.start_recurring_period = event.start
+                changed_rules.append(rule)
+
+        for rule in changed_rules:
+            rule.save(update_fields=['start_recurring_period'] if rule.pk is not None else None)
+        return events
+
+    def bulk_create_events(self, events, batch_size=None):
+        """
+            Inserts many new events with bulk_create(). Rules given by pk are loaded
+            with a single query, group sources are initialized by prepare_group_sources(),
+            unsaved rules are saved one at a time. Exceptions default their original
+            start and end to start and end.
+            Like bulk_create(), neither save() is called nor are signals sent.
+        """
+        events = list(events)
+        rule_cache = self.model._meta.get_field('rule').get_cache_name()
+        rule_pks = set(event.rule_id for event in events if event.rule_id is not None and not hasattr(event, rule_cache))
+        if rule_pks:
+            rules = Rule.objects.in_bulk(rule_pks)
+            for event in events:
+                if event.rule_id in rules and not hasattr(event, rule_cache):
+                    event.rule = rules[event.rule_id]
+
+        self.prepare_group_sources(events)
+        unsaved_rules = {}
+        for event in events:
+            if event.rule_id is None and event.rule is not None:
+                unsaved_rules[id(event.rule)] = event.rule
+        for rule in unsaved_rules.values():
+            if rule.pk is None:
+                rule.save()
+
+        content_type = ContentType.objects.get_for_model(self.model)
+        for event in events:
+            if event.rule_id is None and event.rule is not None:
+                #the rule was assigned before it was saved.
+                event.rule = event.rule
+            if event.rule_id is not None and event.cancelled is not None:
+                if event.original_start is None:
+                    event.original_start = event.start
+                if event.original_end is None:
+                    event.original_end = event.end
+            if not event.content_type_id:
+                event.content_type = content_type
+        return self.bulk_create(events, batch_size)
+
+    def update_next_occurrences(self, events=None, now=None):
+        """
+            Stores the next occurrence of the given source-events, by default of
+            those whose stored next occurrence has started or was never computed.
+            Takes one update per event.
+        """
+        if now is None:
+            now = timezone.now()
+        if events is None:
+            events = self.source_events().filter(
+                models.Q(next_occurrence_start__lt=now) | models.Q(next_occurrence_checked=None)
+            )
+        events = list(events)
+        for event in events:
+            occurrence = event.get_next_occurrence(now)
+            event.next_occurrence_start = occurrence.start if occurrence else None
+            event.next_occurrence_end = occurrence.end if occurrence else None
+            event.next_occurrence_checked = now
+            Event.objects.filter(pk=event.pk).update(
+                next_occurrence_start=event.next_occurrence_start,
+                next_occurrence_end=event.next_occurrence_end,
+                next_occurrence_checked=now,
+            )
+        return events
+
+    def due(self, lead=None, now=None):
+        """
+            Returns the source-events whose next occurrence starts before now + lead
+            (a timedelta), ordered by that start. Relies on update_next_occurrences().
+        """
+        if now is None:
+            now = timezone.now()
+        if lead is not None:
+            now = now + lead
+        return self.source_events().filter(next_occurrence_start__lte=now).order_by('next_occurrence_start')
+
 class BaseEvent(with_metaclass(models.base.ModelBase, *get_model_bases())):
     content_type = models.ForeignKey(ContentType, editable=False, null=True)
     objects = EventManager()
 
-    occurrence_subclasses = {}
-
     class Meta():
         abstract=True
 
@@ -154,11 +494,12 @@ class BaseEvent(with_metaclass(models.base.ModelBase, *get_model_bases())):
         self.save_base(*args, **kwargs)
 
     def as_leaf_class(self):
-        if self.content_type:
-            model = self.content_type.model_class()
-            if model == self.__class__:
-                return self
-            return model.objects.get(id=self.id)
+        if self.content_type_id:
+            with measure('as_leaf_class', type(self), self):
+                model = ContentType.objects.get_for_id(self.content_type_id).model_class()
+                if model == self.__class__:
+                    return self
+                return model._base_manager.get(pk=self.pk)
         else:
             return self
 
@@ -176,8 +517,22 @@ class Event(BaseEvent):
 
     calendar = models.ForeignKey(Calendar, null=True, blank=True)
 
+    #Denormalized next occurrence of source-events, see EventManager.update_next_occurrences()
+    next_occurrence_start = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+    next_occurrence_end = models.DateTimeField(null=True, blank=True, editable=False)
+    #None until computed, no next occurrence at all leaves next_occurrence_start None.
+    next_occurrence_checked = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
     class Meta():
         abstract=False
+        #group sources are found by rule and cancelled=None, exceptions and
+        #singular events by rule and (original) start, calendars by end.
+        index_together = (
+            ('rule', 'cancelled'),
+            ('rule', 'start'),
+            ('rule', 'original_start'),
+            ('calendar', 'end'),
+        )
 
     @property
     def slug(self):
@@ -190,6 +545,24 @@ class Event(BaseEvent):
         return self._slug
 
     def save(self, *args, **kwargs):
+        #saves that leave the timeslot as it was loaded can't add conflicts.
+        if settings.PREVENT_CONFLICTS and self._timeslot_changed():
+            conflicts = self.get_conflicts()
+            if conflicts:
+                raise OccurrenceConflict(conflicts)
+
+        if self.pk is None and self.cancelled is None and self.rule is not None:
+            type(self).objects.prepare_group_sources([self])
+        if self.rule_id is None and self.rule is not None:
+            if self.rule.pk is None:
+                self.rule.save()
+            #the pk of a rule saved after it was assigned isn't copied by django.
+            self.rule = self.rule
+
+        if not settings.TRACK_NEXT_OCCURRENCES and (self.rule_id is None or self.cancelled is None):
+            #the stored next occurrence may be outdated now.
+            self.next_occurrence_checked = None
+
         reset_saved = False
         if self.group_source == self:
             reset_saved = True
@@ -199,28 +572,51 @@ class Event(BaseEvent):
         super(Event, self).save(*args, **kwargs)
         if reset_saved:
             self.group_source = self
+        self._conflict_state = self._get_conflict_state()
 
+        if settings.TRACK_NEXT_OCCURRENCES:
+            if self.rule_id is None or self.cancelled is None:
+                Event.objects.update_next_occurrences([self])
+            else:
+                Event.objects.update_next_occurrences(Event.objects.filter(rule=self.rule_id, cancelled=None))
+        elif self.rule_id is not None and self.cancelled is not None:
+            #exceptions change the next occurrence of their group.
+            Event.objects.filter(rule=self.rule_id, cancelled=None).update(next_occurrence_checked=None)
+
+    #Construction must never hit the database!
+    #Everything that requires a query is done by
+    #EventManager.prepare_group_sources() before saving.
     def __init__(self, *args, **kwargs):
         if kwargs.get('rule', None) and not kwargs.get('cancelled', False) == None:
             kwargs['cancelled'] = None
-            try:
-                type(self).objects.get(rule=kwargs['rule'], cancelled=None)
-            except type(self).DoesNotExist:
-                if not kwargs['rule'].start_recurring_period:
-                    kwargs['rule'].start_recurring_period = kwargs['start']
-                    kwargs['rule'].save()
-                kwargs.setdefault('original_start', kwargs['start'])
-                kwargs.setdefault('original_end'  , kwargs['end']  )
 
         self.group_source = self
 
         super(Event, self).__init__(*args, **kwargs)
-        if self.rule:
-            self.event_group = type(self).objects.filter(rule=self.rule).exclude(cancelled=None)
-        else:
-            #this may blow up in our face!
-            #need to save before pk exists.
-            self.event_group = type(self).objects.filter(pk = self.pk)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Event, cls).from_db(db, field_names, values)
+        instance._conflict_state = instance._get_conflict_state()
+        return instance
+
+    def _get_conflict_state(self):
+        #None if deferred fields leave the timeslot unknown, they are never loaded for this.
+        if any(name not in self.__dict__ for name in CONFLICT_FIELDS):
+            return None
+        return tuple(self.__dict__[name] for name in CONFLICT_FIELDS)
+
+    def _timeslot_changed(self):
+        state = self._get_conflict_state()
+        #rules assigned before they were saved have no rule_id yet.
+        new_rule = self.rule_id is None and getattr(self.__dict__.get('_rule_cache'), 'pk', 0) is None
+        return state is None or new_rule or state != getattr(self, '_conflict_state', None)
+
+    @property
+    def event_group(self):
+        if self.rule_id is None:
+            return type(self).objects.none()
+        return type(self).objects.filter(rule=self.rule_id).exclude(cancelled=None)
 
     def __str__(self):
         #date_format default format is 'DATE_FORMAT'
@@ -235,7 +631,7 @@ class Event(BaseEvent):
     #Need this WHAT FOR exactly?
     def __eq__(self, other):
         #Check weather same timeslot is occupied!
-        return isinstance(other, Event) and self.start == other.start and self.end == other.end
+        return isinstance(other, (Event, Occurrence)) and self.start == other.start and self.end == other.end
 
     @property
     def duration(self):
@@ -277,27 +673,172 @@ class Event(BaseEvent):
             self.cancelled = False
             self.save()
 
+    def get_conflicts(self):
+        """
+            Returns the occurrences of this event's calendar overlapping it's timeslot.
+            Source-events check their occurrences within the next CONFLICT_CHECK_DAYS.
+            The calendar is read as OccurrenceColumns, only overlapping occurrences
+            are created as objects.
+        """
+        if self.calendar_id is None or self.cancelled:
+            return []
+        if self.cancelled is None and self.rule is not None:
+            end = self.start + timedelta(days=settings.CONFLICT_CHECK_DAYS)
+            if self.rule.end_recurring_period and self.rule.end_recurring_period + self.duration < end:
+                end = self.rule.end_recurring_period + self.duration
+            own = [occurrence for occurrence in self.get_occurrences(self.start, end) if not occurrence.cancelled]
+        else:
+            own = [self]
+        if not own:
+            return []
+
+        #own timeslots merged to disjoint windows, ordered by start.
+        windows = []
+        for occurrence in sorted(own, key=operator.attrgetter('start')):
+            window_start, window_end = to_epoch(occurrence.start), to_epoch(occurrence.end)
+            if windows and window_start <= windows[-1][1]:
+                windows[-1][1] = max(windows[-1][1], window_end)
+            else:
+                windows.append([window_start, window_end])
+        window_starts = [window[0] for window in windows]
+
+        start = min(occurrence.start for occurrence in own)
+        end = max(occurrence.end for occurrence in own)
+        columns = Event.objects.filter(calendar=self.calendar_id).occurrence_columns(start, end)
+        overlapping = []
+        for i in range(len(columns)):
+            if columns.cancelled[i]:
+                continue
+            #the last window starting before the occurrence ends is the only candidate.
+            index = bisect.bisect_left(window_starts, columns.end[i]) - 1
+            if index >= 0 and windows[index][1] > columns.start[i]:
+                overlapping.append(i)
+
+        persisted = Event.objects.in_bulk([columns.persisted[i] for i in overlapping if columns.persisted[i]])
+        sources = Event.objects.in_bulk([columns.source[i] for i in overlapping if not columns.persisted[i]])
+        naive = start.tzinfo is None
+        conflicts = []
+        for i in overlapping:
+            if columns.persisted[i]:
+                occurrence = persisted[columns.persisted[i]]
+            else:
+                occurrence = Occurrence(
+                    sources[columns.source[i]], from_epoch(columns.start[i], naive), from_epoch(columns.end[i], naive)
+                )
+            if not self._is_same_occurrence(occurrence):
+                conflicts.append(occurrence)
+        return conflicts
+
+    def _is_same_occurrence(self, occurrence):
+        if self.pk is not None and occurrence.pk == self.pk:
+            return True
+        if self.rule_id is None:
+            #occurrences of singular events are backed by the event only once changed.
+            source = getattr(occurrence, 'source', None)
+            return self.pk is not None and source is not None and source.pk == self.pk
+        if occurrence.rule_id != self.rule_id:
+            return False
+        #a source-event is checked against other groups only,
+        #an exception replaces the occurrence of it's original timeslot.
+        return self.cancelled is None or (
+            occurrence.original_start == self.original_start and occurrence.original_end == self.original_end
+        )
+
     def _clone_model(self):
-        new_kwargs = dict([(fld.name, getattr(self, fld.name)) for fld in self._meta.fields if fld.name != 'id'])
+        #primary keys and parent links of subclasses must not be copied,
+        #the clone would overwrite the source otherwise.
+        #The next occurrence is only tracked on source-events.
+        new_kwargs = dict([
+            (fld.name, getattr(self, fld.name))
+            for fld in self._meta.fields
+            if not fld.primary_key and not getattr(fld.remote_field, 'parent_link', False)
+            and fld.name not in ('next_occurrence_start', 'next_occurrence_end', 'next_occurrence_checked')
+        ])
         return self.__class__(**new_kwargs)
 
-    def get_occurrences(self, start, end):
-        persisted_occurrences = self.event_group.filter(models.Q(end__gte=start, start__lte=end) | models.Q(original_end__gte=start, original_start__lte=end))
-        occ_replacer = OccurrenceReplacer(persisted_occurrences)
+    def get_occurrences(self, start, end, persisted_occurrences=None):
+        #persisted_occurrences may be passed in by callers that already
+        #loaded the exceptions of this event group (see Period).
+        with measure('get_occurrences', type(self), self) as measurement:
+            if persisted_occurrences is None:
+                persisted_occurrences = self._get_persisted_occurrences(start, end)
+            occ_replacer = OccurrenceReplacer(persisted_occurrences)
+
+            occurrences = self._get_occurrence_list(start, end)
+            measurement.generated = len(occurrences)
+            final_occurrences = []
+            for occ in occurrences:
+                if occ_replacer.has_occurrence(occ):
+                    measurement.replaced += 1
+                    p_occ = occ_replacer.get_occurrence(occ)
+                    if p_occ.start < end and p_occ.end >= start:
+                        final_occurrences.append(p_occ)
+
+                else:
+                    final_occurrences.append(occ)
+
+            final_occurrences += occ_replacer.get_additional_occurrences(start, end)
+            return final_occurrences
+
+    async def aget_occurrences(self, start, end, persisted_occurrences=None):
+        """
+            Coroutine version of get_occurrences(), the exceptions
+            and the rule of this event are loaded concurrently.
+        """
+        if persisted_occurrences is None:
+            persisted_occurrences, rule = await asyncio.gather(
+                run_in_thread(list, self._get_persisted_occurrences(start, end)),
+                run_in_thread(getattr, self, 'rule'),
+            )
+        return await run_in_thread(self.get_occurrences, start, end, persisted_occurrences)
 
-        occurrences = self._get_occurrence_list(start, end)
-        final_occurrences = []
-        for occ in occurrences:
-            if occ_replacer.has_occurrence(occ):
-                p_occ = occ_replacer.get_occurrence(occ)
-                if p_occ.start < end and p_occ.end >= start:
-                    final_occurrences.append(p_occ)
+    def iter_occurrences(self, start, end, persisted_occurrences=None):
+        """
+            Yields the same occurrences as get_occurrences(), ordered by end.
+            Occurrences of the rule are created one at a time.
+        """
+        if self.rule is None:
+            for occurrence in sorted(self.get_occurrences(start, end, persisted_occurrences)):
+                yield occurrence
+            return
+        if persisted_occurrences is None:
+            persisted_occurrences = self._get_persisted_occurrences(start, end)
+        occ_replacer = OccurrenceReplacer(persisted_occurrences)
 
-            else:
-                final_occurrences.append(occ)
+        rule_end = end
+        if self.rule.end_recurring_period and self.rule.end_recurring_period < end:
+            rule_end = self.rule.end_recurring_period
+        dtstart = self.get_rrule_start()
+        duration = self.duration
+
+        #Exceptions within the period are returned, whether they replace an
+        #occurrence or not. Only cancelled ones have to replace an occurrence.
+        persisted = []
+        for occ in occ_replacer.lookup.values():
+            if not (occ.start < end and occ.end >= start):
+                continue
+            if occ.cancelled and not (
+                start - duration <= occ.original_start <= rule_end and
+                occ.original_end == occ.original_start + duration and
+                self.rule.between(occ.original_start, occ.original_start, dtstart)
+            ):
+                continue
+            persisted.append(occ)
+        persisted.sort(key=operator.attrgetter('end'))
+
+        generated = (
+            self._create_occurrence(occ_start, occ_start + duration)
+            for occ_start in self.rule.xbetween(start - duration, rule_end, dtstart)
+        )
+        generated = (occ for occ in generated if not occ_replacer.has_occurrence(occ))
+        for occurrence_end, rank, occurrence in heapq.merge(
+            ((occ.end, 0, occ) for occ in persisted),
+            ((occ.end, 1, occ) for occ in generated),
+        ):
+            yield occurrence
 
-        final_occurrences += occ_replacer.get_additional_occurrences(start, end)
-        return final_occurrences
+    def _get_persisted_occurrences(self, start, end):
+        return self.event_group.filter(models.Q(end__gte=start, start__lte=end) | models.Q(original_end__gte=start, original_start__lte=end))
 
     def _get_occurrence_list(self, start, end):
         if self.rule is None:
@@ -309,8 +850,7 @@ class Event(BaseEvent):
         occurrences = []
         if self.rule.end_recurring_period and self.rule.end_recurring_period < end:
             end = self.rule.end_recurring_period
-        rule = self.get_rrule_object()
-        occ_starts = rule.between(start-self.duration, end, inc=True)
+        occ_starts = self.rule.between(start-self.duration, end, self.get_rrule_start())
 
         for start in occ_starts:
             end = start + self.duration
@@ -320,22 +860,62 @@ class Event(BaseEvent):
 
         return occurrences
 
+    def add_occurrence_columns(self, columns, start, end, persisted_occurrences=()):
+        """
+            Same as get_occurrences(), but appends the occurrences to
+            an OccurrenceColumns instead of creating objects.
+        """
+        if self.rule is None:
+            if self.start < end and self.end > start:
+                columns.append(self.pk, self.start, self.end, self.cancelled, self.pk)
+            return columns
+
+        lookup = dict(((occ.original_start, occ.original_end), occ) for occ in persisted_occurrences)
+        rule_end = end
+        if self.rule.end_recurring_period and self.rule.end_recurring_period < end:
+            rule_end = self.rule.end_recurring_period
+        duration = self.duration
+        for occ_start in self.rule.between(start - duration, rule_end, self.get_rrule_start()):
+            occ_end = occ_start + duration
+            persisted = lookup.pop((occ_start, occ_end), None)
+            if persisted is None:
+                columns.append(self.pk, occ_start, occ_end)
+            elif persisted.start < end and persisted.end >= start:
+                columns.append(self.pk, persisted.start, persisted.end, persisted.cancelled, persisted.pk)
+
+        for persisted in lookup.values():
+            if persisted.start < end and persisted.end >= start and not persisted.cancelled:
+                columns.append(self.pk, persisted.start, persisted.end, persisted.cancelled, persisted.pk)
+        return columns
+
     def _create_occurrence(self, start, end=None):
         if end is None:
             end = start + self.duration
-        ret = self.group_source._clone_model()
-
-        ret.original_start = ret.start = start
-        ret.original_end   = ret.end   = end
-        ret.cancelled = False
-        return ret
+        return Occurrence(self.group_source, start, end)
 
     def get_rrule_object(self):
         if self.rule is None:
             return None
-        params = self.rule.get_params()
-        frequency = self.rule.rrule_frequency()
-        return rrule.rrule(frequency, dtstart = self.rule.start_recurring_period, **params)
+        return self.rule.get_rrule_object(self.get_rrule_start())
+
+    def get_rrule_start(self):
+        #start_recurring_period is only set once the event was saved.
+        return self.rule.start_recurring_period or self.original_start or self.start
+
+    def get_next_occurrence(self, after=None):
+        """
+            Returns the first occurrence starting at or after *after*
+            that is not cancelled, None if there is none.
+        """
+        if after is None:
+            after = timezone.now()
+        #occurrences of singular events don't carry the event's cancelled flag.
+        if self.rule_id is None and self.cancelled:
+            return None
+        for occurrence in self.occurrences_after(after):
+            if occurrence.start >= after and not occurrence.cancelled:
+                return occurrence
+        return None
 
     def get_occurrence(self, start, exact=False):
         ret = next(self.occurrences_after(start))
@@ -345,6 +925,10 @@ class Event(BaseEvent):
             return ret
 
     def occurrences_after(self, after=None):
+        measurement = measure('occurrences_after', type(self), self)
+        return measurement.iterate(self._occurrences_after(after, measurement))
+
+    def _occurrences_after(self, after, measurement):
         if after is None:
             after = timezone.now()
         if settings.HIDE_NAIVE_AWARE_TYPE_ERROR and timezone.is_naive(after) and settings.USE_TZ:
@@ -365,11 +949,16 @@ class Event(BaseEvent):
                 yield trickies.pop(0)
             
             if nxt is None:
-                raise StopIteration
+                return
 
-            yield occ_replacer.get_occurrence(nxt)
+            measurement.generated += 1
+            occ = occ_replacer.get_occurrence(nxt)
+            if occ is not nxt:
+                measurement.replaced += 1
+            yield occ
 
-    def _occurrences_after_generator(self, after=None, tzinfo=timezone.utc):
+    def _occurrences_after_generator(self, after=None, tzinfo=timezone.utc, running=False):
+        #with running, occurrences that started before after but end later are included.
         if after is None:
             after = timezone.now()
         rule = self.get_rrule_object()
@@ -377,18 +966,27 @@ class Event(BaseEvent):
         if rule is None:
             if self.end > after:
                 yield self._create_occurrence(self.start, self.end)
-            raise StopIteration
+            return
 
         else:
-            date_iter = rule.xafter(after, inc=True)
-            while True:
-                start = next(date_iter)
+            for start in rule.xafter(after - self.duration if running else after, inc=True):
                 if self.rule.end_recurring_period and start > self.rule.end_recurring_period:
-                    raise StopIteration
+                    return
                 end = start + self.duration
                 if end > after:
                     yield self._create_occurrence(start, end)
 
+@receiver(post_save, sender=Rule)
+def update_next_occurrences_of_rule(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    #new rules have no events yet, rules get their start before their first source-event is saved.
+    if raw or created or update_fields == frozenset(['start_recurring_period']):
+        return
+    if settings.TRACK_NEXT_OCCURRENCES:
+        Event.objects.update_next_occurrences(Event.objects.filter(rule=instance.pk, cancelled=None))
+    else:
+        #recomputed by the next update_next_occurrences().
+        Event.objects.filter(rule=instance.pk, cancelled=None).update(next_occurrence_checked=None)
+
 class EventRelationManager(models.Manager):
     def get_events_for_object(self, content_object, distinction=None, queryset=Event.objects, inherit=True):
         ct = ContentType.objects.get_for_model(type(content_object))
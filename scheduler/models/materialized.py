@@ -0,0 +1,155 @@
+from __future__ import unicode_literals
+from django.utils.six import with_metaclass
+# -*- coding: utf-8 -*-
+
+import datetime
+from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+from django.utils.formats import date_format
+
+from scheduler.settings import settings
+from scheduler.models.utils import get_model_bases
+from scheduler.models.rules import Rule
+from scheduler.models.calendars import Calendar
+from scheduler.models.events import Event
+from scheduler.models.occurrences import Occurrence
+
+#Materialization is optional: with MATERIALIZE_OCCURRENCES enabled, the
+#occurrences of every source event within the next MATERIALIZATION_DAYS
+#are stored as rows, so range queries don't have to expand rules.
+#Rows are refreshed whenever an event or rule is saved, the
+#materialize_occurrences command moves the horizon forward.
+
+class MaterializedOccurrenceManager(models.Manager):
+
+    def horizon(self, now=None):
+        if now is None:
+            now = timezone.now()
+        return now, now + datetime.timedelta(days=settings.MATERIALIZATION_DAYS)
+
+    def between(self, start, end, calendar=None):
+        """
+            Returns the rows overlapping start and end, ordered by start.
+            Only covers the materialized horizon!
+        """
+        rows = self.filter(start__lt=end, end__gt=start)
+        if calendar is not None:
+            rows = rows.filter(calendar=calendar)
+        return rows.order_by('start', 'pk')
+
+    def refresh(self, events=None, now=None):
+        """
+            Replaces the rows of given source events with their occurrences in the horizon.
+            Without events, all source events are materialized and rows
+            that ended before now are dropped.
+        """
+        start, end = self.horizon(now)
+        if events is None:
+            self.filter(end__lte=start).delete()
+            events = Event.objects.source_events().without_leaf_classes().filter(
+                models.Q(rule=None, end__gt=start, start__lt=end) | ~models.Q(rule=None)
+            ).exclude(rule__end_recurring_period__lte=start)
+        events = list(events)
+        if not events:
+            return []
+
+        persisted = {}
+        exceptions = Event.objects.all().without_leaf_classes().filter(
+            models.Q(end__gte=start, start__lte=end) | models.Q(original_end__gte=start, original_start__lte=end),
+            rule__in=set(event.rule_id for event in events if event.rule_id is not None)
+        ).exclude(cancelled=None)
+        for exception in exceptions:
+            persisted.setdefault(exception.rule_id, []).append(exception)
+
+        rows = []
+        for event in events:
+            if event.rule_id is None:
+                occurrences = event._get_occurrence_list(start, end)
+                #singular events are cancelled themselves.
+                for occurrence in occurrences:
+                    occurrence.cancelled = bool(event.cancelled)
+            else:
+                occurrences = event.get_occurrences(start, end, persisted.get(event.rule_id, []))
+            rows.extend(
+                self.model.from_occurrence(event, occurrence)
+                for occurrence in occurrences
+            )
+        self.filter(event__in=events).delete()
+        self.bulk_create(rows)
+        return rows
+
+    def refresh_for(self, event):
+        #singular events are their own source, exceptions refresh their group.
+        if event.rule_id is None:
+            sources = [event]
+        else:
+            sources = Event.objects.all().without_leaf_classes().filter(rule=event.rule_id, cancelled=None)
+        return self.refresh(sources)
+
+@python_2_unicode_compatible
+class MaterializedOccurrence(with_metaclass(models.base.ModelBase, *get_model_bases())):
+    event = models.ForeignKey(Event, related_name='materialized_occurrences')
+    exception = models.ForeignKey(Event, null=True, blank=True, related_name='+', on_delete=models.SET_NULL)
+    calendar = models.ForeignKey(Calendar, null=True, blank=True)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    original_start = models.DateTimeField()
+    original_end = models.DateTimeField()
+    cancelled = models.BooleanField(default=False)
+
+    objects = MaterializedOccurrenceManager()
+
+    class Meta():
+        index_together = (('calendar', 'start'),)
+
+    def __str__(self):
+        return '%s - %s' %(date_format(self.start), date_format(self.end))
+
+    @classmethod
+    def from_occurrence(cls, source, occurrence):
+        #persisted exceptions are Event instances, generated ones are Occurrences.
+        exception = occurrence if isinstance(occurrence, Event) and occurrence.pk != source.pk else None
+        return cls(
+            event=source,
+            exception=exception,
+            calendar_id=source.calendar_id,
+            start=occurrence.start,
+            end=occurrence.end,
+            original_start=occurrence.original_start or occurrence.start,
+            original_end=occurrence.original_end or occurrence.end,
+            cancelled=bool(occurrence.cancelled),
+        )
+
+    def as_occurrence(self):
+        if self.exception_id is not None:
+            return self.exception
+        if self.event.rule_id is None:
+            occurrence = self.event._create_occurrence(self.start, self.end)
+            occurrence.cancelled = self.cancelled
+            return occurrence
+        return Occurrence(self.event, self.start, self.end, self.original_start, self.original_end, self.cancelled)
+
+@receiver(post_save)
+def materialize_event(sender, instance, raw=False, **kwargs):
+    if not settings.MATERIALIZE_OCCURRENCES or raw or not isinstance(instance, Event):
+        return
+    MaterializedOccurrence.objects.refresh_for(instance)
+
+@receiver(post_delete)
+def dematerialize_event(sender, instance, **kwargs):
+    #rows of deleted source events are removed by the cascade.
+    if not settings.MATERIALIZE_OCCURRENCES or not isinstance(instance, Event):
+        return
+    if instance.rule_id is not None and instance.cancelled is not None:
+        MaterializedOccurrence.objects.refresh_for(instance)
+
+@receiver(post_save, sender=Rule)
+def materialize_rule(sender, instance, raw=False, **kwargs):
+    if not settings.MATERIALIZE_OCCURRENCES or raw:
+        return
+    MaterializedOccurrence.objects.refresh(
+        Event.objects.all().without_leaf_classes().filter(rule=instance.pk, cancelled=None)
+    )
@@ -0,0 +1,185 @@
+from __future__ import unicode_literals
+# -*- coding: utf-8 -*-
+
+import datetime
+from array import array
+from django.utils import timezone
+from django.utils.formats import date_format
+
+#Occurrences are the non-database representation of an Event at a given time.
+#They only carry their own timeslot and reference the source event for
+#everything else. A full Event instance is created only when an occurrence
+#is changed (setting a model field) and persisted only on save(), move() or
+#cancel().
+class Occurrence(object):
+    __slots__ = ('source', 'start', 'end', 'original_start', 'original_end', 'cancelled', '_event')
+
+    def __init__(self, source, start, end, original_start=None, original_end=None, cancelled=False):
+        self.source = source
+        self.start = start
+        self.end = end
+        self.original_start = start if original_start is None else original_start
+        self.original_end = end if original_end is None else original_end
+        self.cancelled = cancelled
+        self._event = None
+
+    def __getattr__(self, attr):
+        #only called for attributes not found on the occurrence itself.
+        if attr in Occurrence.__slots__ or attr.startswith('__'):
+            raise AttributeError(attr)
+        if self._event is not None:
+            return getattr(self._event, attr)
+        return getattr(self.source, attr)
+
+    def __setattr__(self, attr, value):
+        try:
+            object.__setattr__(self, attr, value)
+        except AttributeError:
+            #anything that is not part of the timeslot belongs to the model.
+            setattr(self.as_event(), attr, value)
+
+    def __str__(self):
+        return '%s - %s' %(date_format(self.start), date_format(self.end))
+
+    def __repr__(self):
+        return '<%s: %s>' %(type(self).__name__, self)
+
+    def __lt__(self, other):
+        return self.end < other.end
+
+    def __gt__(self, other):
+        return self.start > other.start
+
+    def __eq__(self, other):
+        #Same semantics as Event: the same timeslot is occupied.
+        #Comparison with events is handled by Event.__eq__
+        if not isinstance(other, Occurrence):
+            return NotImplemented
+        return self.start == other.start and self.end == other.end
+
+    __hash__ = None
+
+    @property
+    def pk(self):
+        if self._event is None:
+            return None
+        return self._event.pk
+
+    id = pk
+
+    @property
+    def slug(self):
+        from scheduler.models.events import SLUG_DATE_FORMAT
+        if self.source.pk is None:
+            return None
+        return "%i-%s"%(self.source.pk, self.start.strftime(SLUG_DATE_FORMAT))
+
+    @property
+    def duration(self):
+        return self.end-self.start
+
+    @property
+    def seconds(self):
+        return self.duration.total_seconds()
+
+    @property
+    def minutes(self):
+        return float(self.seconds) / 60
+
+    @property
+    def hours(self):
+        return float(self.seconds) / 3600
+
+    @property
+    def moved(self):
+        return not (self.original_start == self.start and self.original_end == self.end)
+
+    def as_leaf_class(self):
+        return self
+
+    def as_event(self):
+        """
+            Returns the model instance backing this occurrence, creating it if necessary.
+            A singular event is it's own occurrence, recurring events get an unsaved clone
+            of their source event.
+        """
+        if self._event is None:
+            if self.source.rule_id is None and self.source.pk is not None:
+                event = self.source
+            else:
+                event = self.source._clone_model()
+                event.original_start = self.original_start
+                event.original_end = self.original_end
+            object.__setattr__(self, '_event', event)
+        return self._event
+
+    def save(self, *args, **kwargs):
+        event = self.as_event()
+        event.start = self.start
+        event.end = self.end
+        event.cancelled = self.cancelled
+        event.save(*args, **kwargs)
+
+    def move(self, new_start, new_end = None):
+        self.end = new_end or new_start + (self.end - self.start)
+        self.start = new_start
+        self.save()
+
+    def cancel(self):
+        self.cancelled = True
+        self.save()
+
+    def uncancel(self):
+        if self.cancelled:
+            self.cancelled = False
+            self.save()
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+NAIVE_EPOCH = datetime.datetime(1970, 1, 1)
+SECOND = datetime.timedelta(seconds=1)
+
+def to_epoch(dt):
+    #naive datetimes are taken as UTC.
+    return (dt - (NAIVE_EPOCH if dt.tzinfo is None else EPOCH)) // SECOND
+
+def from_epoch(seconds, naive=False):
+    return (NAIVE_EPOCH if naive else EPOCH) + seconds * SECOND
+
+class OccurrenceColumns(object):
+    """
+        Occurrences as parallel arrays instead of objects, for consumers that only
+        need their timeslots: pk of the source event, start and end in whole seconds
+        since the epoch, cancelled flag and pk of the persisted exception
+        (the event itself for singular events, 0 for generated occurrences).
+        The arrays support the buffer protocol, numpy.frombuffer() reads them without copying.
+    """
+    fields = ('source', 'start', 'end', 'cancelled', 'persisted')
+
+    def __init__(self):
+        self.source = array('q')
+        self.start = array('q')
+        self.end = array('q')
+        self.cancelled = array('b')
+        self.persisted = array('q')
+
+    def __len__(self):
+        return len(self.start)
+
+    def append(self, source, start, end, cancelled=False, persisted=None):
+        self.source.append(source or 0)
+        self.start.append(to_epoch(start))
+        self.end.append(to_epoch(end))
+        self.cancelled.append(bool(cancelled))
+        self.persisted.append(persisted or 0)
+
+    def sort(self):
+        #by start, then end.
+        order = sorted(range(len(self)), key=lambda i: (self.start[i], self.end[i]))
+        for field in self.fields:
+            column = getattr(self, field)
+            setattr(self, field, array(column.typecode, [column[i] for i in order]))
+        return self
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.fields)
+
@@ -1,11 +1,18 @@
 
+import datetime
+import threading
+from collections import OrderedDict, namedtuple
 from dateutil import rrule
 from django.db import models
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.utils.six import with_metaclass
 from django.utils.encoding import python_2_unicode_compatible
 from django.utils.six.moves.builtins import str
 
 from scheduler.models.utils import get_model_bases
+from scheduler.settings import settings
+from scheduler.instrumentation import measure
 
 freqs = (("YEARLY", "Yearly"),
     ("MONTHLY", "Monthly"),
@@ -15,6 +22,17 @@ freqs = (("YEARLY", "Yearly"),
     ("MINUTELY", "Minutely"),
     ("SECONDLY", "Secondly"))
 
+#Rules of these frequencies without BY* params recur at a fixed distance,
+#their occurrences can be computed without dateutil.
+FIXED_STEPS = {
+    'WEEKLY': datetime.timedelta(weeks=1),
+    'DAILY': datetime.timedelta(days=1),
+    'HOURLY': datetime.timedelta(hours=1),
+    'MINUTELY': datetime.timedelta(minutes=1),
+    'SECONDLY': datetime.timedelta(seconds=1),
+}
+FIXED_STEP_PARAMS = ('interval', 'count')
+
 @python_2_unicode_compatible
 class Rule(with_metaclass(models.base.ModelBase, *get_model_bases())):
     name=models.CharField(max_length=32)
@@ -31,7 +49,8 @@ class Rule(with_metaclass(models.base.ModelBase, *get_model_bases())):
             'WEEKLY': rrule.WEEKLY,
             'DAILY': rrule.DAILY,
             'HOURLY': rrule.HOURLY,
-
+            'MINUTELY': rrule.MINUTELY,
+            'SECONDLY': rrule.SECONDLY,
         }
         return compatibility_dict[self.frequency]
 
@@ -52,5 +71,128 @@ class Rule(with_metaclass(models.base.ModelBase, *get_model_bases())):
                 param_dict.append(param)
         return dict(param_dict)
 
+    def get_rrule_object(self, dtstart=None):
+        with measure('get_rrule_object', type(self), self):
+            return rrule_cache.get(self, dtstart or self.start_recurring_period)
+
+    def get_fixed_step(self):
+        """
+            Returns the distance between two occurrences and the count limit
+            (or None) for rules recurring at a fixed distance, None otherwise.
+        """
+        if self.frequency not in FIXED_STEPS:
+            return None
+        params = self.get_params()
+        if not set(params).issubset(FIXED_STEP_PARAMS):
+            return None
+        interval = params.get('interval', 1)
+        count = params.get('count')
+        if not isinstance(interval, int) or interval < 1 or isinstance(count, list):
+            return None
+        return FIXED_STEPS[self.frequency] * interval, count
+
+    def between(self, after, before, dtstart=None):
+        """
+            Returns all starts from *after* to *before*, both inclusive.
+            Same as get_rrule_object(dtstart).between(after, before, inc=True),
+            but computed arithmetically where possible.
+        """
+        dtstart = dtstart or self.start_recurring_period
+        fixed = self._get_fixed_range(after, before, dtstart)
+        if fixed is None:
+            return self.get_rrule_object(dtstart).between(after, before, inc=True)
+        dtstart, step, indexes = fixed
+        return [dtstart + step * i for i in indexes]
+
+    def xbetween(self, after, before, dtstart=None):
+        """
+            Generator version of between(), starts are computed one at a time.
+        """
+        dtstart = dtstart or self.start_recurring_period
+        fixed = self._get_fixed_range(after, before, dtstart)
+        if fixed is None:
+            for start in self.get_rrule_object(dtstart).xafter(after, inc=True):
+                if start > before:
+                    return
+                yield start
+            return
+        dtstart, step, indexes = fixed
+        for i in indexes:
+            yield dtstart + step * i
+
+    def _get_fixed_range(self, after, before, dtstart):
+        fixed_step = self.get_fixed_step()
+        #arithmetic on datetimes is wall clock arithmetic, like dateutil's,
+        #but comparisons are not: zones with DST need dateutil.
+        if fixed_step is None or (dtstart.tzinfo is not None and dtstart.tzinfo.utcoffset(None) is None):
+            return None
+        step, count = fixed_step
+        dtstart = dtstart.replace(microsecond=0)
+        first = max(0, -((dtstart - after) // step))
+        last = (before - dtstart) // step
+        if count is not None:
+            last = min(last, count - 1)
+        return dtstart, step, range(first, last + 1)
+
+    def _build_rrule(self, dtstart):
+        return rrule.rrule(self.rrule_frequency(), dtstart=dtstart, **self.get_params())
+
     def __str__(self):
-        return "Rule %s, params: %s" %(self.name, self.params)
\ No newline at end of file
+        return "Rule %s, params: %s" %(self.name, self.params)
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+class RRuleCache(object):
+    """
+        Process-wide LRU cache of compiled rrule objects.
+        Entries are keyed by the rule's pk and everything the rrule is built from,
+        so a changed but unsaved rule never gets a stale rrule.
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, rule, dtstart):
+        if rule.pk is None or not self.maxsize:
+            return rule._build_rrule(dtstart)
+        key = (rule.pk, rule.frequency, rule.params, dtstart)
+        with self._lock:
+            compiled = self._cache.get(key)
+            if compiled is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        compiled = rule._build_rrule(dtstart)
+        with self._lock:
+            self._cache[key] = compiled
+            while len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return compiled
+
+    def invalidate(self, pk):
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == pk]:
+                del self._cache[key]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self._cache))
+
+rrule_cache = RRuleCache(settings.RRULE_CACHE_SIZE)
+
+@receiver(post_save, sender=Rule)
+@receiver(post_delete, sender=Rule)
+def invalidate_rrule_cache(sender, instance, **kwargs):
+    rrule_cache.invalidate(instance.pk)
\ No newline at end of file
@@ -1,6 +1,8 @@
 from django.db import models
+from django.contrib.contenttypes.models import ContentType
 from django.utils.module_loading import import_string
 from scheduler.settings import settings
+from scheduler.instrumentation import measure
 
 #The following three classes allow:
 # * All Event Subclasses to share the EventManager (abstract classes pass on Managers!)
@@ -9,23 +11,47 @@ from scheduler.settings import settings
 
 # Subclassing approach based on
 # http://www.djangosnippets.org/snippets/1034/
+# Leaf classes are resolved in bulk, one query per subclass instead of one per row.
 class SubclassingQuerySet(models.QuerySet):
-    def __getitem__(self, k):
-        result = super(SubclassingQuerySet, self).__getitem__(k)
-        if hasattr(result, 'as_leaf_class') :
-            return result.as_leaf_class()
-        else :
-            return result
-
-    def __iter__(self):
-        for item in super(SubclassingQuerySet, self).__iter__():
-            if hasattr(item, 'as_leaf_class'):
-                yield item.as_leaf_class()
-            else:
-                yield item
-
-#    def get(self, *args, **kwargs):
-#        return super(SubclassingQuerySet, self).get(*args, **kwargs).as_leaf_class()
+    _leaf_classes = True
+
+    def _clone(self, **kwargs):
+        clone = super(SubclassingQuerySet, self)._clone(**kwargs)
+        clone._leaf_classes = self._leaf_classes
+        return clone
+
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.iterator())
+            if self._leaf_classes:
+                with measure('resolve_leaf_classes', type(self), self):
+                    resolve_leaf_classes(self._result_cache, self.db)
+        super(SubclassingQuerySet, self)._fetch_all()
+
+    def without_leaf_classes(self):
+        clone = self._clone()
+        clone._leaf_classes = False
+        return clone
+
+def resolve_leaf_classes(items, using=None):
+    """
+        Replaces all model instances in *items* by instances of their leaf class.
+        Order is preserved, requires one query per leaf class.
+    """
+    pending = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, models.Model) or not getattr(item, 'content_type_id', None):
+            continue
+        model = ContentType.objects.db_manager(using).get_for_id(item.content_type_id).model_class()
+        if model is None or model == type(item):
+            continue
+        pending.setdefault(model, []).append(index)
+
+    for model, indexes in pending.items():
+        leaves = model._base_manager.using(using).in_bulk([items[index].pk for index in indexes])
+        for index in indexes:
+            items[index] = leaves.get(items[index].pk, items[index])
+    return items
 
 def get_model_bases():
     baseStrings = settings['SCHEDULER_BASE_CLASSES']
@@ -37,15 +63,15 @@ def get_model_bases():
 class OccurrenceReplacer(object):
 
     def __init__(self, persisted_occurrences):
-        lookup = [((occ.original_start, occ.original_end, occ.rule), occ) for occ in persisted_occurrences]
+        lookup = [((occ.original_start, occ.original_end, occ.rule_id), occ) for occ in persisted_occurrences]
         self.lookup = dict(lookup)
 
     def get_occurrence(self, occ):
-        return self.lookup.pop((occ.original_start, occ.original_end, occ.rule), occ)
+        return self.lookup.pop((occ.original_start, occ.original_end, occ.rule_id), occ)
 
     def has_occurrence(self, occ):
         try:
-            return (occ.original_start, occ.original_end, occ.rule) in self.lookup
+            return (occ.original_start, occ.original_end, occ.rule_id) in self.lookup
         except TypeError:
             if not self.lookup:
                 return False
@@ -58,33 +84,41 @@ class OccurrenceReplacer(object):
 
 import operator
 class NextOccurrenceReplacer(object):
+    """
+        Replaces a stream of generated occurrences, ordered by start, with persisted ones.
+        Generated occurrences with a persisted counterpart are dropped,
+        persisted occurrences are returned once the stream reaches their start.
+    """
 
     def __init__(self, persisted_occurrences):
-        self.lookup = [((occ.original_start, occ.original_end, occ.rule), occ) for occ in sorted(persisted_occurrences, key=operator.attrgetter("start"), reverse=True)]
+        self.lookup = [((occ.original_start, occ.original_end, occ.rule_id), occ) for occ in sorted(persisted_occurrences, key=operator.attrgetter("start"), reverse=True)]
+        self.keys = set(key for key, occ in self.lookup)
 
     def get_next_occurrences(self, occ):
-        if self.lookup and (occ.original_start, occ.original_end, occ.rule) == self.lookup[-1][0]:
-            return [self.lookup.pop()[1]]
-
         ret = []
-        while self.lookup and self.lookup[-1][1].start <= occ.original_start:
+        while self.lookup and self.lookup[-1][1].start <= occ.start:
             ret.append(self.lookup.pop()[1])
+        if not self.is_replaced(occ):
+            ret.append(occ)
         return ret
 
+    def is_replaced(self, occ):
+        return (occ.original_start, occ.original_end, occ.rule_id) in self.keys
+
     def is_next_occurrence(self, occ):
-        if self.lookup and self.lookup[-1][0] == (occ.original_start, occ.original_end, occ.rule):
+        if self.lookup and self.lookup[-1][0] == (occ.original_start, occ.original_end, occ.rule_id):
             return True
         return False
 
     def get_additional_occurrences(self, start, end):
         ret = []
-        for tup_occ in self.lookup:
+        for tup_occ in reversed(self.lookup):
             occ = tup_occ[1]
             if occ.start < start:
                 continue
             elif occ.start > end:
                 break
-            ret.apppend(occ)
+            ret.append(occ)
         return ret
 
     def remaining_occurrences(self):
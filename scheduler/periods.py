@@ -2,10 +2,19 @@ from __future__ import unicode_literals
 from django.utils.six.moves.builtins import range
 # -*- coding: utf-8 -*-
 
+import asyncio
+import bisect
+import calendar
 import datetime
+import heapq
+import operator
 from scheduler.settings import settings
+from scheduler.instrumentation import measure
+from scheduler.asynchronous import run_in_thread
 from scheduler.models import Event
+from scheduler.models.occurrences import OccurrenceColumns
 from django.db.models import Q
+from django.db.models.query import prefetch_related_objects
 from django.utils import timezone
 from django.utils.dates import WEEKDAYS, WEEKDAYS_ABBR
 from django.utils.formats import date_format
@@ -39,15 +48,106 @@ else:
 #    weekday_abbrs.append(WEEKDAYS_ABBR[i])
 
 
+class IntervalIndex(object):
+    """
+        Static index over items with *start* and *end* attributes.
+        Items are sorted by start, a segment tree over that order keeps the latest
+        end of every range. overlapping() finds the candidates by binary search on
+        start and only descends into ranges that reach the requested start.
+    """
+    def __init__(self, items):
+        self.items = sorted(items, key=operator.attrgetter('start'))
+        self.starts = [item.start for item in self.items]
+        size = 1
+        while size < len(self.items):
+            size *= 2
+        self._size = size
+        self._max_end = [None] * (2 * size)
+        for i, item in enumerate(self.items):
+            self._max_end[size + i] = item.end
+        for node in range(size - 1, 0, -1):
+            left, right = self._max_end[2 * node], self._max_end[2 * node + 1]
+            self._max_end[node] = left if right is None or (left is not None and left > right) else right
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def overlapping(self, start, end):
+        """
+            returns all items ending at or after *start* and starting at or before *end*,
+            ordered by start.
+        """
+        high = bisect.bisect_right(self.starts, end)
+        found = []
+        stack = [(1, 0, self._size)] if high else []
+        while stack:
+            node, low, node_end = stack.pop()
+            max_end = self._max_end[node]
+            if low >= high or max_end is None or max_end < start:
+                continue
+            if node >= self._size:
+                found.append(self.items[node - self._size])
+                continue
+            middle = (low + node_end) // 2
+            stack.append((2 * node + 1, middle, node_end))
+            stack.append((2 * node, low, middle))
+        return found
+
+class OccurrencePool(IntervalIndex):
+    """
+        Occurrences of a period, to be shared with sub-periods.
+        *start* and *end* are the bounds the occurrences were computed for,
+        a pool only answers for periods within these bounds.
+    """
+    def __init__(self, occurrences, start=None, end=None, events=None):
+        super(OccurrencePool, self).__init__(occurrences)
+        self.start = start
+        self.end = end
+        self.events = events
+
+    @property
+    def occurrences(self):
+        return self.items
+
+    def between(self, start, end):
+        return self.overlapping(start, end)
+
+def find_conflicts(occurrences):
+    """
+        Returns all pairs of overlapping occurrences, the earlier start first.
+        A sweep over the occurrences ordered by start keeps the ones still running
+        in a heap ordered by end, O(n log n) plus the number of pairs.
+    """
+    conflicts = []
+    running = []
+    for index, occurrence in enumerate(sorted(occurrences, key=operator.attrgetter('start'))):
+        while running and running[0][0] <= occurrence.start:
+            heapq.heappop(running)
+        for end, running_index, other in running:
+            conflicts.append((other, occurrence))
+        heapq.heappush(running, (occurrence.end, index, occurrence))
+    return conflicts
+
+def _ranked_by_end(rank, occurrences):
+    #The rank keeps ties in the order of sources and
+    #prevents occurrences from being compared.
+    for occurrence in occurrences:
+        yield occurrence.end, rank, occurrence
+
 class Period(object):
     def __init__(self, events, start, end, persisted_occurrences=None, tzinfo = timezone.utc, occurrence_pool=None):
         self.utc_start = self._normalize_timezone_to_utc(start, tzinfo)
         self.utc_end = self._normalize_timezone_to_utc(end, tzinfo)
         self.events = events
-        self.rules = [event.rule.pk for event in events if event.rule]
+        self.rules = set(event.rule_id for event in events if event.rule_id)
         self.tzinfo = self._get_tzinfo(tzinfo)
         self.occurrence_pool = occurrence_pool
         self._persisted_occurrences = persisted_occurrences
+        #Period whose occurrences cover this one, see derive_sub_period()
+        self._pool_parent = None
 
     def _normalize_timezone_to_utc(self, point_in_time, tzinfo):
         if not hasattr(point_in_time, 'tzinfo'):
@@ -80,36 +180,64 @@ class Period(object):
         return tzinfo if settings.USE_TZ else None
 
     def _get_sorted_occurrences(self):
-        occurrences = []
-        pool = getattr(self, "occurrence_pool", None)
-        if pool is not None:
-            for occurrence in pool:
-                if occurrence.rule:
-                    test =  occurrence.rule.pk in self.rules
-                else:
-                    test = occurrence in self.events
-                if test and occurrence.start <= self.utc_end and occurrence.end >= self.utc_start:
-                    occurrences.append(occurrence)
+        with measure('_get_sorted_occurrences', type(self), self) as measurement:
+            occurrences = []
+            pool = getattr(self, "occurrence_pool", None)
+            if pool is None and getattr(self, "_pool_parent", None) is not None:
+                pool = self.occurrence_pool = self._pool_parent.get_occurrence_pool()
+            if pool is not None:
+                if not isinstance(pool, IntervalIndex):
+                    pool = self.occurrence_pool = OccurrencePool(pool)
+                occurrences = pool.overlapping(self.utc_start, self.utc_end)
+                if getattr(pool, 'events', None) is not self.events:
+                    #foreign pool, occurrences have to belong to the events of this period.
+                    event_pks = set(event.pk for event in self.events if not event.rule_id and event.pk)
+                    occurrences = [
+                        occurrence for occurrence in occurrences
+                        if (occurrence.rule_id in self.rules if occurrence.rule_id else occurrence.group_source.pk in event_pks)
+                    ]
+            else:
+                start, end = self._get_datetime_bounds()
+                persisted = self._get_persisted_lookup()
+                for source in self._get_sources():
+                    event_occurrences = source.get_occurrences(start, end, persisted.get(source.rule_id, []) if source.rule_id else [])
+                    occurrences += event_occurrences
+
+            measurement.generated = len(occurrences)
+            return sorted(occurrences)
+
+    def _get_datetime_bounds(self):
+        # We only save DATETIME!
+        if datetime.date in [type(self.start), type(self.end)]:
+            start = datetime.datetime.combine(self.start, datetime.time.min.replace(tzinfo=timezone.utc))
+            end = datetime.datetime.combine(self.end, datetime.time.min.replace(tzinfo=timezone.utc))
         else:
-            # We only save DATETIME!
-            if datetime.date in [type(self.start), type(self.end)]:
-                start = datetime.datetime.combine(self.start, datetime.time.min.replace(tzinfo=timezone.utc))
-                end = datetime.datetime.combine(self.end, datetime.time.min.replace(tzinfo=timezone.utc))
+            start = self.start
+            end = self.end
+        return start, end
+
+    def _get_sources(self):
+        if getattr(self, '_sources', None) is not None:
+            return self._sources
+        sources = []
+        for event in self.events:
+            if event.group_source in sources:
+                continue
             else:
-                start = self.start
-                end = self.end
-            
-            sources = []
-            for event in self.events:
-                if event.group_source in sources:
-                    continue
-                else:
-                    sources.append(event.group_source)
-            for source in sources:
-                event_occurrences = source.get_occurrences(start, end)
-                occurrences += event_occurrences
-
-        return sorted(occurrences)
+                sources.append(event.group_source)
+        prefetch_related_objects(sources, ['rule'])
+        return sources
+
+    def get_occurrence_columns(self):
+        """
+            Returns the occurrences of this period as OccurrenceColumns, ordered by start.
+        """
+        start, end = self._get_datetime_bounds()
+        persisted = self._get_persisted_lookup()
+        columns = OccurrenceColumns()
+        for source in self._get_sources():
+            source.add_occurrence_columns(columns, start, end, persisted.get(source.rule_id, []) if source.rule_id else [])
+        return columns.sort()
 
     @property
     def occurrences(self):
@@ -118,13 +246,80 @@ class Period(object):
         self._occurrences = self._get_sorted_occurrences()
         return self._occurrences
 
+    async def aoccurrences(self):
+        """
+            Coroutine version of occurrences, the source events and the
+            persisted occurrences of this period are loaded concurrently.
+        """
+        if not hasattr(self, '_occurrences'):
+            if getattr(self, 'occurrence_pool', None) is None and getattr(self, '_pool_parent', None) is None:
+                sources, persisted = await asyncio.gather(
+                    run_in_thread(self._get_sources),
+                    run_in_thread(self._get_persisted_lookup),
+                )
+                self._sources = sources
+            await run_in_thread(getattr, self, 'occurrences')
+        return self._occurrences
+
+    def iter_occurrences(self):
+        """
+            Yields the occurrences of this period in the order of occurrences,
+            merging the ordered streams of all sources. Iteration can stop early
+            without computing the remaining occurrences.
+        """
+        if hasattr(self, '_occurrences') or getattr(self, 'occurrence_pool', None) is not None \
+            or getattr(self, '_pool_parent', None) is not None:
+            #occurrences of a pool are computed anyway.
+            for occurrence in self.occurrences:
+                yield occurrence
+            return
+        start, end = self._get_datetime_bounds()
+        persisted = self._get_persisted_lookup()
+        streams = [
+            source.iter_occurrences(start, end, persisted.get(source.rule_id, []) if source.rule_id else [])
+            for source in self._get_sources()
+        ]
+        for occurrence_end, rank, occurrence in heapq.merge(*[
+            _ranked_by_end(rank, stream) for rank, stream in enumerate(streams)
+        ]):
+            yield occurrence
+
+    def get_conflicts(self):
+        """
+            Returns all pairs of overlapping occurrences of this period, cancelled ones excluded.
+        """
+        return find_conflicts(occurrence for occurrence in self.occurrences if not occurrence.cancelled)
+
+    def get_occurrence_pool(self):
+        if not hasattr(self, '_occurrence_pool'):
+            pool = getattr(self, "occurrence_pool", None)
+            if pool is None and getattr(self, "_pool_parent", None) is not None:
+                pool = self._pool_parent.get_occurrence_pool()
+            if not (isinstance(pool, OccurrencePool) and pool.events is self.events):
+                pool = OccurrencePool(self.occurrences, self.utc_start, self.utc_end, self.events)
+            self._occurrence_pool = pool
+        return self._occurrence_pool
+
     def get_persisted_occurrences(self):
-        if not getattr(self, '_persisted_occurrences', None):
-            events = Q(pk__in = self.events, rule=None) if None in self.rules else Q()
-            groups = Q(rule__in=self.rules)
-            self._persisted_occurrences = Event.objects.filter(groups | events)
+        #One query for the exceptions of all rules and all singular events,
+        #limited to occurrences that are or were scheduled within the period.
+        if getattr(self, '_persisted_occurrences', None) is None:
+            window = Q(start__lte=self.utc_end, end__gte=self.utc_start) | \
+                Q(original_start__lte=self.utc_end, original_end__gte=self.utc_start)
+            groups = Q(rule__in=self.rules) & ~Q(cancelled=None)
+            events = Q(pk__in=[event.pk for event in self.events if event.rule_id is None and event.pk])
+            self._persisted_occurrences = list(Event.objects.filter(window, groups | events))
         return self._persisted_occurrences
 
+    def _get_persisted_lookup(self):
+        #persisted exceptions grouped by rule, shared by all sources.
+        if getattr(self, '_persisted_lookup', None) is None:
+            self._persisted_lookup = {}
+            for occurrence in self.get_persisted_occurrences():
+                if occurrence.rule_id and occurrence.cancelled is not None:
+                    self._persisted_lookup.setdefault(occurrence.rule_id, []).append(occurrence)
+        return self._persisted_lookup
+
     @property
     def has_occurrences(self):
         return any(self.classify_occurrence(o) for o in self.occurrences)
@@ -228,7 +423,14 @@ class TimeRange(Period):
     def derive_sub_period(self, cls, start=None, tzinfo=None):
         tzinfo = tzinfo or self.tzinfo
         start = start or self.start
-        return cls(self.events, start, self.get_persisted_occurrences(), tzinfo)
+        period = cls(self.events, start, tzinfo=tzinfo)
+        #sub-periods reuse the occurrences of this period where possible,
+        #they are computed once the first sub-period needs them. Others
+        #query their own exceptions, those of this period may not cover them.
+        if self.utc_start <= period.utc_start and period.utc_end <= self.utc_end:
+            period._persisted_occurrences = self.get_persisted_occurrences()
+            period._pool_parent = self
+        return period
 
     def _get_range(self, start):
         if hasattr(self, "given_start"):
@@ -261,7 +463,7 @@ class TimeRange(Period):
             return self.get_periods(cls)
         elif attr.startswith('current_') and attr[8:] in ['year', 'month', 'week', 'day']:
             cls = eval(attr[8:].capitalize())
-            return cls(self.events, self.start, self.get_persisted_occurrences())
+            return self.derive_sub_period(cls, tzinfo=timezone.utc)
         else:
             raise AttributeError("Can't find %s" %attr)
 
@@ -275,16 +477,6 @@ class TimeDelta(object):
         "second",
         "microsecond",
     )
-    modulo=[
-        0,      #years, will be ignored
-        12,     #months
-        31,     #days, requires more care!
-        24,     #hours
-        60,     #minuts
-        60,     #seconds
-        1000,   #microseconds
-    ]
-
     def __init__(self, **kwargs):
         self.values = []
         for i, unit in enumerate(self.units):
@@ -302,31 +494,20 @@ class TimeDelta(object):
             Expects a datetime object as argument,
             which will be transposed by a specified amount.
         """
-        quarks = {}
-        newMonth = False
-        for i, unit in enumerate(self.units):
-            if hasattr(other, unit) and self.values[i] !=0:
-                quarks[unit] = (self.values[i] + getattr(other, unit))
-                if i> 0 and quarks[unit] > self.modulo[i]:
-                    quarks[unit] = quarks[unit] % self.modulo[i]
-                    if self.units[i-1] in quarks:
-                        quarks[self.units[i-1]] += 1
-                    else:
-                        quarks[self.units[i-1]] = getattr(other, self.units[i-1], 0) + 1
-                    if unit == "day":
-                        newMonth = True
-
-        error = None
-        for j in range(3):
-            try:
-                return other.replace(**quarks)
-            except ValueError as e:
-                if j > 2:
-                    raise ValueError(e)
-                quarks["day"] = quarks['day'] - 1 if 'day' in quarks else getattr(other, 'day', 0) - 1
-                if not newMonth:
-                    newMonth=True
-                    quarks['month'] = quarks['month'] + 1 if 'month' in quarks else getattr(other, 'month', 0) + 1
+        #years and months are calendar arithmetic, the day is clamped
+        #to the length of the resulting month. Everything else is a timedelta.
+        years, months = self.values[0], self.values[1]
+        if years or months:
+            month_index = other.month - 1 + months
+            year = other.year + years + month_index // 12
+            month = month_index % 12 + 1
+            day = min(other.day, calendar.monthrange(year, month)[1])
+            other = other.replace(year=year, month=month, day=day)
+
+        delta = datetime.timedelta(**dict([
+            (unit + 's', self.values[i]) for i, unit in enumerate(self.units) if i > 1
+        ]))
+        return other + delta
 
     def __str__(self):
         return str(dict([(unit, self.values[i]) for i, unit in enumerate(self.units)]))
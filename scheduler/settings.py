@@ -21,4 +21,10 @@ settings = Settings(
     FIRST_DAY_OF_WEEK = 1,
     HIDE_NAIVE_AWARE_TYPE_ERROR = False,
     USE_TZ = True,
+    RRULE_CACHE_SIZE = 128,
+    MATERIALIZE_OCCURRENCES = False,
+    MATERIALIZATION_DAYS = 180,
+    PREVENT_CONFLICTS = False,
+    CONFLICT_CHECK_DAYS = 365,
+    TRACK_NEXT_OCCURRENCES = False,
 )
\ No newline at end of file
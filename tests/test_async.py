@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from scheduler.asynchronous import run_in_thread
+from scheduler.models import Event, Rule
+from scheduler.periods import Period
+
+def run(coroutine):
+    return asyncio.get_event_loop().run_until_complete(coroutine)
+
+#Queries are sent from executor threads, which only see committed data.
+class TestAsyncOccurrences(TransactionTestCase):
+
+    def setUp(self):
+        rule = Rule.objects.create(frequency="DAILY")
+        self.event = Event.objects.create(
+            start=datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 5, 9, 0, tzinfo=timezone.utc),
+            rule=rule,
+        )
+        for day in (6, 8, 30):
+            Event.objects.create(
+                start=datetime.datetime(2008, 1, day, 10, 0, tzinfo=timezone.utc),
+                end=datetime.datetime(2008, 1, day, 11, 0, tzinfo=timezone.utc),
+            )
+        self.event.get_occurrence(datetime.datetime(2008, 1, 7, 8, 0, tzinfo=timezone.utc)).cancel()
+        self.start = datetime.datetime(2008, 1, 5, tzinfo=timezone.utc)
+        self.end = datetime.datetime(2008, 1, 10, tzinfo=timezone.utc)
+
+    def slots(self, occurrences):
+        return [(occ.start, occ.end, occ.cancelled) for occ in occurrences]
+
+    def test_aget_occurrences(self):
+        event = Event.objects.get(pk=self.event.pk)
+        self.assertEqual(
+            self.slots(run(event.aget_occurrences(self.start, self.end))),
+            self.slots(self.event.get_occurrences(self.start, self.end)),
+        )
+
+    def test_aoccurrences_after(self):
+        generators = []
+        async def collect(occurrences, count):
+            found = []
+            async with occurrences:
+                async for occurrence in occurrences:
+                    found.append(occurrence)
+                    if len(found) == count:
+                        break
+                generators.append(occurrences._iterator)
+            return found
+        found = run(collect(Event.objects.all().aoccurrences_after(self.start, chunk_size=2), 8))
+        #the generator was closed after the early break.
+        self.assertIsNone(generators[0].gi_frame)
+        expected = []
+        for occurrence in Event.objects.all().occurrences_after(self.start):
+            expected.append(occurrence)
+            if len(expected) == 8:
+                break
+        self.assertEqual(self.slots(found), self.slots(expected))
+
+    def test_aoccurrences_exhausted(self):
+        async def collect(occurrences):
+            return [occurrence async for occurrence in occurrences]
+        found = run(collect(Event.objects.filter(rule=None).aoccurrences_after(self.start)))
+        self.assertEqual(len(found), 3)
+
+    def test_period_aoccurrences(self):
+        period = Period(Event.objects.source_events(), self.start, self.end)
+        occurrences = run(period.aoccurrences())
+        self.assertIs(occurrences, period.occurrences)
+        self.assertEqual(
+            self.slots(occurrences),
+            self.slots(Period(Event.objects.source_events(), self.start, self.end).occurrences),
+        )
+
+    def test_connections_closed_after_queries(self):
+        checked = []
+        patched = []
+        def count():
+            from django.db import connections
+            connection = connections['default']
+            close = connection.close_if_unusable_or_obsolete
+            connection.close_if_unusable_or_obsolete = lambda: (checked.append(True), close())
+            patched.append(connection)
+            return Event.objects.count()
+        try:
+            self.assertEqual(run(run_in_thread(count)), 5)
+        finally:
+            #the executor thread outlives the test.
+            for connection in patched:
+                del connection.close_if_unusable_or_obsolete
+        self.assertEqual(checked, [True])
@@ -0,0 +1,34 @@
+from django.test import TestCase
+
+from benchmarks.run import BENCHMARKS, measure
+from benchmarks.seed import seed
+from scheduler.models import Event
+
+class TestBenchmarks(TestCase):
+
+    def test_seed(self):
+        seed(calendars=2, rules=3, exceptions=4, singles=5)
+        self.assertEqual(Event.objects.filter(rule=None).count(), 5)
+        self.assertEqual(Event.objects.exclude(rule=None).filter(cancelled=None).count(), 3)
+        self.assertEqual(Event.objects.exclude(rule=None).exclude(cancelled=None).count(), 4)
+
+    def test_benchmarks_run(self):
+        start = seed(calendars=2, rules=3, exceptions=4, singles=5)
+        for factory in BENCHMARKS:
+            result = measure(factory, start, 1)
+            self.assertGreater(result['queries'], 0)
+
+class TestQueryPlans(TestCase):
+
+    def test_indexes_used(self):
+        from django.db import connection
+        from benchmarks.plans import QUERIES, query_plan, index_names
+        if connection.vendor != 'sqlite':
+            self.skipTest("plans are only checked on SQLite")
+        start = seed(calendars=2, rules=3, exceptions=4, singles=5)
+        indexes = index_names(Event)
+        for name, (factory, columns) in QUERIES.items():
+            plan = query_plan(factory(start))
+            self.assertTrue(any(indexes[tuple(columns)] in line for line in plan), (name, plan))
+        #single events are read in the order of the index.
+        self.assertFalse(any('TEMP B-TREE' in line for line in query_plan(QUERIES['single_events'][0](start))))
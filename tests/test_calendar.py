@@ -1,10 +1,10 @@
 
 import datetime
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
-from scheduler.models import Event, Rule, Calendar, CalendarRelation
+from scheduler.models import Event, Rule, Calendar, CalendarRelation, OccurrenceConflict
 
 class TestCalendar(TestCase):
 
@@ -88,4 +88,205 @@ class TestCalendar(TestCase):
         rule = Rule()
         rule.save()
         calendars = list(Calendar.objects.get_calendars_for_object(rule, distinction='owner'))
-        self.assertEqual(len(calendars), 0)
\ No newline at end of file
+        self.assertEqual(len(calendars), 0)
+
+class TestCalendarOccurrencesAfter(TestCase):
+
+    def setUp(self):
+        self.calendar = Calendar(name="MyCal")
+        self.calendar.save()
+        self.start = datetime.datetime(2008, 1, 1, 8, 0, tzinfo=timezone.utc)
+        rule = Rule(frequency="DAILY", end_recurring_period=datetime.datetime(2008, 1, 6, 0, 0, tzinfo=timezone.utc))
+        rule.save()
+        self.recurring = Event.objects.create(
+            start=self.start,
+            end=self.start + datetime.timedelta(hours=1),
+            rule=rule,
+            calendar=self.calendar
+        )
+        for i in range(5):
+            Event.objects.create(
+                start=self.start + datetime.timedelta(days=i, hours=2),
+                end=self.start + datetime.timedelta(days=i, hours=3),
+                calendar=self.calendar
+            )
+
+    def test_recurring_and_single_events_merged(self):
+        occurrences = list(self.calendar.occurrences_after(self.start))
+        self.assertEqual(len(occurrences), 10)
+        self.assertEqual([occ.start for occ in occurrences], sorted(occ.start for occ in occurrences))
+        self.assertEqual([occ.rule_id is None for occ in occurrences[:4]], [False, True, False, True])
+
+    def test_persisted_occurrences_replace_generated(self):
+        occurrences = self.recurring.get_occurrences(self.start, self.start + datetime.timedelta(days=3))
+        occurrences[0].move(self.start + datetime.timedelta(days=4, hours=5))
+        occurrences[1].cancel()
+        occurrences = list(self.calendar.occurrences_after(self.start))
+        self.assertEqual(len(occurrences), 10)
+        self.assertEqual(len([occ for occ in occurrences if occ.cancelled]), 1)
+        self.assertEqual(occurrences[-1].start, self.start + datetime.timedelta(days=4, hours=5))
+        self.assertEqual(occurrences[-1].original_start, self.start)
+
+    def test_single_events_streamed(self):
+        #sources, rules, persisted occurrences and the first chunk
+        with self.assertNumQueries(4):
+            occurrences = self.calendar.events.all().occurrences_after(self.start, chunk_size=2)
+            first = next(occurrences)
+        self.assertEqual(first.start, self.start)
+        #two more chunks for the remaining single events
+        with self.assertNumQueries(2):
+            self.assertEqual(len(list(occurrences)), 9)
+
+    def test_occurrences_between_pages(self):
+        #a second event at the same time as the recurring one
+        Event.objects.create(
+            start=self.start + datetime.timedelta(days=2),
+            end=self.start + datetime.timedelta(days=2, hours=1),
+            calendar=self.calendar
+        )
+        window = (self.start + datetime.timedelta(hours=2, minutes=30), self.start + datetime.timedelta(days=4))
+        expected = list(self.calendar.events.all().occurrences_between(*window)[0])
+        self.assertEqual(len(expected), 8)
+        self.assertEqual(expected[0].start, self.start + datetime.timedelta(hours=2))
+
+        for limit in (1, 2, 4):
+            pages = []
+            occurrences, cursor = self.calendar.events.all().occurrences_between(*window, limit=limit)
+            pages += occurrences
+            while cursor is not None:
+                occurrences, cursor = self.calendar.events.all().occurrences_between(*window, limit=limit, cursor=cursor)
+                self.assertTrue(len(occurrences) <= limit)
+                pages += occurrences
+            self.assertEqual(
+                [(occ.start, occ.end, occ.source.pk) for occ in pages],
+                [(occ.start, occ.end, occ.source.pk) for occ in expected]
+            )
+
+    def test_occurrences_between_running_recurring_occurrence(self):
+        #the recurring occurrence of day 1 runs at the start of the window.
+        window = (self.start + datetime.timedelta(days=1, minutes=30), self.start + datetime.timedelta(days=2, hours=2, minutes=30))
+        expected = [
+            (self.start + datetime.timedelta(days=1), self.recurring.pk),
+            (self.start + datetime.timedelta(days=1, hours=2), None),
+            (self.start + datetime.timedelta(days=2), self.recurring.pk),
+            (self.start + datetime.timedelta(days=2, hours=2), None),
+        ]
+        occurrences = self.calendar.events.all().occurrences_between(*window)[0]
+        self.assertEqual([(occ.start, occ.source.pk if occ.rule_id else None) for occ in occurrences], expected)
+        self.assertEqual(
+            [occ.start for occ in self.recurring.get_occurrences(*window)],
+            [start for start, source in expected if source],
+        )
+        #with limit 1, the first cursor points to the running occurrence, before the window.
+        for limit in (1, 3):
+            pages = []
+            occurrences, cursor = self.calendar.events.all().occurrences_between(*window, limit=limit)
+            pages += occurrences
+            while cursor is not None:
+                occurrences, cursor = self.calendar.events.all().occurrences_between(*window, limit=limit, cursor=cursor)
+                pages += occurrences
+            self.assertEqual([occ.start for occ in pages], [start for start, source in expected])
+
+    def test_occurrences_between_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            self.calendar.events.all().occurrences_between(self.start, self.start, cursor="nonsense")
+
+class TestCalendarConflicts(TestCase):
+
+    def setUp(self):
+        self.calendar = Calendar.objects.create(name="Room")
+        self.rule = Rule.objects.create(frequency="DAILY")
+        self.source = Event.objects.create(
+            start=datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 5, 10, 0, tzinfo=timezone.utc),
+            rule=self.rule,
+            calendar=self.calendar,
+        )
+        self.single = Event.objects.create(
+            start=datetime.datetime(2008, 1, 6, 12, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 6, 13, 0, tzinfo=timezone.utc),
+            calendar=self.calendar,
+        )
+
+    def test_get_conflicts(self):
+        Event.objects.create(
+            start=datetime.datetime(2008, 1, 7, 9, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 7, 11, 0, tzinfo=timezone.utc),
+            calendar=self.calendar,
+        )
+        #other calendars don't conflict.
+        Event.objects.create(
+            start=datetime.datetime(2008, 1, 6, 9, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 6, 11, 0, tzinfo=timezone.utc),
+        )
+        conflicts = self.calendar.get_conflicts(datetime.datetime(2008, 1, 1, tzinfo=timezone.utc), datetime.datetime(2008, 1, 10, tzinfo=timezone.utc))
+        self.assertEqual(
+            [(first.start, second.start) for first, second in conflicts],
+            [(datetime.datetime(2008, 1, 7, 8, 0, tzinfo=timezone.utc), datetime.datetime(2008, 1, 7, 9, 0, tzinfo=timezone.utc))],
+        )
+
+    @override_settings(PREVENT_CONFLICTS=True)
+    def test_save_prevents_conflicts(self):
+        event = Event(
+            start=datetime.datetime(2008, 1, 6, 12, 30, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 6, 14, 0, tzinfo=timezone.utc),
+            calendar=self.calendar,
+        )
+        with self.assertRaises(OccurrenceConflict) as context:
+            event.save()
+        self.assertEqual(context.exception.conflicts, [self.single])
+        self.assertIsNone(event.pk)
+        #touching is fine, other calendars as well.
+        event.start = self.single.end
+        event.save()
+        Event.objects.create(start=self.single.start, end=self.single.end)
+
+    @override_settings(PREVENT_CONFLICTS=True, CONFLICT_CHECK_DAYS=30)
+    def test_save_checks_occurrences_of_new_rules(self):
+        Event.objects.create(
+            start=datetime.datetime(2008, 1, 8, 17, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 8, 18, 0, tzinfo=timezone.utc),
+            calendar=self.calendar,
+        )
+        event = Event(
+            start=datetime.datetime(2008, 1, 6, 16, 30, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 6, 17, 30, tzinfo=timezone.utc),
+            rule=Rule.objects.create(frequency="DAILY"),
+            calendar=self.calendar,
+        )
+        #only the occurrence of day 3 overlaps.
+        with self.assertRaises(OccurrenceConflict) as context:
+            event.save()
+        self.assertEqual([occurrence.start for occurrence in context.exception.conflicts], [datetime.datetime(2008, 1, 8, 17, 0, tzinfo=timezone.utc)])
+        self.assertIsNone(event.pk)
+        #occurrences beyond CONFLICT_CHECK_DAYS aren't checked.
+        with self.settings(CONFLICT_CHECK_DAYS=1):
+            event.save()
+
+    def test_unchanged_timeslot_not_checked(self):
+        overlapping = Event.objects.create(
+            start=datetime.datetime(2008, 1, 7, 9, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 7, 11, 0, tzinfo=timezone.utc),
+            calendar=self.calendar,
+        )
+        with self.settings(PREVENT_CONFLICTS=True):
+            source = Event.objects.get(pk=self.source.pk)
+            #the leaf class and the update, no occurrences are read.
+            with self.assertNumQueries(2):
+                source.save()
+            overlapping.save()
+            overlapping.end += datetime.timedelta(minutes=30)
+            with self.assertRaises(OccurrenceConflict) as context:
+                overlapping.save()
+        self.assertEqual([occurrence.start for occurrence in context.exception.conflicts], [datetime.datetime(2008, 1, 7, 8, 0, tzinfo=timezone.utc)])
+
+    @override_settings(PREVENT_CONFLICTS=True)
+    def test_moving_checks_new_timeslot_only(self):
+        self.single.move(self.single.start + datetime.timedelta(minutes=30))
+        occurrence = self.source.get_occurrence(datetime.datetime(2008, 1, 6, 8, 0, tzinfo=timezone.utc))
+        occurrence.move(occurrence.start + datetime.timedelta(hours=1))
+        with self.assertRaises(OccurrenceConflict):
+            occurrence.move(occurrence.start + datetime.timedelta(hours=3))
+        with self.assertRaises(OccurrenceConflict):
+            self.single.move(datetime.datetime(2008, 1, 7, 9, 0, tzinfo=timezone.utc))
+        self.source.move(self.source.start + datetime.timedelta(minutes=30))
@@ -0,0 +1,69 @@
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from scheduler.dispatcher import Dispatcher
+from scheduler.models import Event, Rule
+
+def at(day, hour, minute=0):
+    return datetime.datetime(2008, 1, day, hour, minute, tzinfo=timezone.utc)
+
+class TestDispatcher(TestCase):
+
+    def setUp(self):
+        self.rule = Rule.objects.create(frequency="HOURLY")
+        self.source = Event.objects.create(start=at(1, 8), end=at(1, 8, 30), rule=self.rule)
+        self.single = Event.objects.create(start=at(5, 9, 15), end=at(5, 10))
+        self.dispatcher = Dispatcher(lookahead=datetime.timedelta(hours=3))
+        self.dispatched = []
+        self.dispatcher.register(self.dispatched.append)
+        self.dispatcher.refresh(at(5, 8, 30))
+
+    def tearDown(self):
+        self.dispatcher.disconnect()
+
+    def starts(self):
+        return [occurrence.start for occurrence in self.dispatched]
+
+    def test_dispatch_due(self):
+        self.assertEqual(self.dispatcher.next_due(), at(5, 9))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.dispatcher.dispatch_due(at(5, 8, 59)), [])
+            self.dispatcher.dispatch_due(at(5, 9, 30))
+        self.assertEqual(self.starts(), [at(5, 9), at(5, 9, 15)])
+        self.assertEqual(self.dispatched[1].source, self.single)
+        #past the horizon, occurrences between the cursor and now are still due.
+        self.dispatcher.dispatch_due(at(5, 13))
+        self.assertEqual(self.starts()[2:], [at(5, 10), at(5, 11), at(5, 12), at(5, 13)])
+        self.assertEqual(self.dispatcher.horizon, at(5, 16))
+
+    def test_refreshes_changed_groups(self):
+        self.dispatcher.connect()
+        self.source.get_occurrence(at(5, 10)).cancel()
+        self.source.get_occurrence(at(5, 11)).move(at(5, 11, 20))
+        self.single.cancel()
+        Event.objects.create(start=at(5, 9, 45), end=at(5, 10))
+        Event.objects.create(start=at(5, 9, 50), end=at(5, 10)).delete()
+        #only the groups of the changed events are loaded again, three queries per singular event.
+        with self.assertNumQueries(13):
+            self.dispatcher.dispatch_due(at(5, 11, 25))
+        self.assertEqual(self.starts(), [at(5, 9), at(5, 9, 45), at(5, 11, 20)])
+
+    def test_failing_handler(self):
+        def fail(occurrence):
+            raise RuntimeError
+        self.dispatcher.handlers.insert(0, fail)
+        with self.assertLogs('scheduler.dispatcher', 'ERROR'):
+            self.dispatcher.dispatch_due(at(5, 9))
+        self.assertEqual(self.starts(), [at(5, 9)])
+
+    def test_run(self):
+        soon = timezone.now() + datetime.timedelta(milliseconds=200)
+        Event.objects.create(start=soon, end=soon + datetime.timedelta(hours=1))
+        dispatcher = Dispatcher(Event.objects.filter(rule=None))
+        @dispatcher.register
+        def stop(occurrence):
+            dispatcher.stop()
+        dispatcher.run()
+        self.assertGreaterEqual(dispatcher.cursor, soon)
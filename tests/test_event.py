@@ -395,6 +395,67 @@ class TestEvent(TestCase):
         event.save()
         self.assertEqual(event.slug, '1-2008-01-05-08-00+0000')
 
+    def test_construction_without_queries(self):
+        cal = Calendar(name="MyCal")
+        cal.save()
+        rule = Rule(frequency="WEEKLY")
+        rule.save()
+        with self.assertNumQueries(0):
+            event = self.__create_recurring_event(
+                datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+                datetime.datetime(2008, 1, 5, 9, 0, tzinfo=timezone.utc),
+                rule,
+                cal,
+            )
+        self.assertIsNone(event.cancelled)
+        self.assertIsNone(event.original_start)
+        self.assertIsNone(rule.start_recurring_period)
+        event.save()
+        self.assertEqual(event.original_start, datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc))
+        self.assertEqual(Rule.objects.get(pk=rule.pk).start_recurring_period, event.start)
+
+    def test_hydration_without_queries(self):
+        rule = Rule(frequency="WEEKLY")
+        rule.save()
+        for i in range(3):
+            self.__create_recurring_event(
+                datetime.datetime(2008, 1, 5+i, 8, 0, tzinfo=timezone.utc),
+                datetime.datetime(2008, 1, 5+i, 9, 0, tzinfo=timezone.utc),
+                rule,
+                None,
+            ).save()
+        with self.assertNumQueries(1):
+            events = list(Event.objects.all().iterator())
+            [event.event_group for event in events]
+        #only the first source-event initialises the rule
+        self.assertEqual([e.original_start is not None for e in events], [True, False, False])
+
+    def test_prepare_group_sources(self):
+        rule = Rule(frequency="DAILY")
+        rule.save()
+        events = [
+            self.__create_recurring_event(
+                datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+                datetime.datetime(2008, 1, 5, 9, 0, tzinfo=timezone.utc),
+                rule,
+                None,
+            ) for i in range(2)
+        ]
+        with self.assertNumQueries(2):
+            Event.objects.prepare_group_sources(events)
+        self.assertEqual(events[0].original_start, events[0].start)
+        self.assertIsNone(events[1].original_start)
+        self.assertEqual(rule.start_recurring_period, events[0].start)
+
+    def test_save_with_unsaved_rule(self):
+        start = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc)
+        event = Event(start=start, end=start + datetime.timedelta(hours=1), rule=Rule(frequency="DAILY"))
+        event.save()
+        created = Event.objects.create(start=start, end=start + datetime.timedelta(hours=1), rule=Rule(frequency="WEEKLY", start_recurring_period=start))
+        self.assertEqual(Event.objects.get(pk=event.pk).rule.frequency, "DAILY")
+        self.assertEqual(Event.objects.get(pk=event.pk).rule.start_recurring_period, start)
+        self.assertEqual(Event.objects.get(pk=created.pk).rule.frequency, "WEEKLY")
+
 class TestEventInheritance(TestEvent):
 
     def __create_event(self, title, start, end, cal):
@@ -473,3 +534,229 @@ class TestEventInheritance(TestEvent):
         newev = Event.objects.get(pk=1)
         testev = newev.as_leaf_class()
         self.assertEqual(testev, ev)
+
+class TestSubclassingQuerySet(TestCase):
+
+    def setUp(self):
+        start = datetime.datetime(2013, 1, 5, 8, 0, tzinfo=timezone.utc)
+        self.types = []
+        for i, model in enumerate([TestSubEvent, Event, FirstSub, TestSubEvent, FirstSub, Event, TestSubEvent]):
+            data = {
+                'start': start + datetime.timedelta(days=i),
+                'end': start + datetime.timedelta(days=i, hours=1),
+            }
+            if model is TestSubEvent:
+                data['title'] = 'title %i' %i
+            model(**data).save()
+            self.types.append(model)
+
+    def test_bulk_leaf_classes(self):
+        with self.assertNumQueries(3):
+            events = list(Event.objects.order_by('start'))
+        self.assertEqual([type(event) for event in events], self.types)
+        self.assertEqual(events[3].title, 'title 3')
+
+    def test_leaf_class_by_index(self):
+        with self.assertNumQueries(2):
+            event = Event.objects.order_by('start')[0]
+        self.assertEqual(type(event), TestSubEvent)
+
+    def test_leaf_class_by_get(self):
+        pk = Event.objects.order_by('start')[0].pk
+        with self.assertNumQueries(2):
+            event = Event.objects.get(pk=pk)
+        self.assertEqual(type(event), TestSubEvent)
+        self.assertEqual(type(Event.objects.filter(pk=pk).first()), TestSubEvent)
+        self.assertEqual(type(Event.objects.all().without_leaf_classes().get(pk=pk)), Event)
+
+    def test_without_leaf_classes(self):
+        with self.assertNumQueries(1):
+            events = list(Event.objects.order_by('start').without_leaf_classes().filter(cancelled=False))
+        self.assertEqual([type(event) for event in events], [Event] * len(self.types))
+
+class TestEventIndexes(TestCase):
+
+    def test_composite_indexes(self):
+        from django.db import connection
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Event._meta.db_table)
+        indexes = [info['columns'] for info in constraints.values() if info['index']]
+        for columns in (['rule_id', 'cancelled'], ['rule_id', 'start'], ['rule_id', 'original_start'], ['calendar_id', 'end']):
+            self.assertIn(columns, indexes)
+
+@override_settings(TRACK_NEXT_OCCURRENCES=True)
+class TestNextOccurrence(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.rule = Rule.objects.create(frequency="DAILY")
+        self.source = Event.objects.create(
+            start=self.now - datetime.timedelta(days=2, hours=1),
+            end=self.now - datetime.timedelta(days=2),
+            rule=self.rule,
+        )
+        self.single = Event.objects.create(
+            start=self.now + datetime.timedelta(hours=5),
+            end=self.now + datetime.timedelta(hours=6),
+        )
+
+    def test_tracked_on_save(self):
+        source = Event.objects.get(pk=self.source.pk)
+        self.assertEqual(source.next_occurrence_start, self.now + datetime.timedelta(hours=23))
+        self.assertEqual(source.next_occurrence_end, self.now + datetime.timedelta(days=1))
+        self.assertEqual(Event.objects.get(pk=self.single.pk).next_occurrence_start, self.single.start)
+
+    def test_exceptions_update_source(self):
+        occurrence = self.source.get_next_occurrence()
+        occurrence.cancel()
+        self.assertEqual(Event.objects.get(pk=self.source.pk).next_occurrence_start, self.now + datetime.timedelta(days=1, hours=23))
+        self.assertIsNone(Event.objects.get(pk=occurrence.pk).next_occurrence_start)
+        self.rule.end_recurring_period = self.now
+        self.rule.save()
+        self.assertIsNone(Event.objects.get(pk=self.source.pk).next_occurrence_start)
+
+    def test_due(self):
+        with self.assertNumQueries(1):
+            due = list(Event.objects.due(datetime.timedelta(hours=6), now=self.now))
+        self.assertEqual(due, [self.single])
+        self.assertEqual([event.pk for event in Event.objects.due(datetime.timedelta(days=1), now=self.now)], [self.single.pk, self.source.pk])
+
+    def test_advance(self):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        later = self.now + datetime.timedelta(days=1)
+        self.assertEqual(len(Event.objects.update_next_occurrences(now=later)), 2)
+        self.assertEqual(Event.objects.get(pk=self.source.pk).next_occurrence_start, later + datetime.timedelta(hours=23))
+        self.assertIsNone(Event.objects.get(pk=self.single.pk).next_occurrence_start)
+        out = StringIO()
+        call_command('advance_next_occurrences', '--all', stdout=out)
+        self.assertIn("2 events", out.getvalue())
+
+    def test_advance_never_computed(self):
+        with self.settings(TRACK_NEXT_OCCURRENCES=False):
+            untracked = Event.objects.create(start=self.now + datetime.timedelta(hours=2), end=self.now + datetime.timedelta(hours=3))
+            Event.objects.bulk_create_events([Event(
+                start=self.now - datetime.timedelta(hours=1), end=self.now, rule=Rule(frequency="WEEKLY"),
+            )])
+        bulk = Event.objects.get(rule__frequency="WEEKLY")
+        self.assertIsNone(bulk.next_occurrence_checked)
+        updated = Event.objects.update_next_occurrences(now=self.now)
+        self.assertEqual(set(event.pk for event in updated), set([untracked.pk, bulk.pk]))
+        self.assertEqual(Event.objects.get(pk=untracked.pk).next_occurrence_start, untracked.start)
+        self.assertEqual(Event.objects.get(pk=bulk.pk).next_occurrence_start, self.now + datetime.timedelta(days=6, hours=23))
+        #events without next occurrence are selected once.
+        self.assertEqual(len(Event.objects.update_next_occurrences(now=self.now + datetime.timedelta(hours=4))), 1)
+        self.assertEqual(len(Event.objects.update_next_occurrences(now=self.now + datetime.timedelta(hours=4))), 0)
+
+    def test_cancelled_single_not_due(self):
+        self.single.cancel()
+        self.assertIsNone(Event.objects.get(pk=self.single.pk).next_occurrence_start)
+        self.assertNotIn(self.single.pk, [event.pk for event in Event.objects.due(datetime.timedelta(days=1), now=self.now)])
+
+    def test_untracked_exceptions_and_rules_reset(self):
+        with self.settings(TRACK_NEXT_OCCURRENCES=False):
+            self.source.get_next_occurrence(self.now).cancel()
+            self.assertIsNone(Event.objects.get(pk=self.source.pk).next_occurrence_checked)
+            self.assertEqual([event.pk for event in Event.objects.update_next_occurrences(now=self.now)], [self.source.pk])
+            self.assertEqual(Event.objects.get(pk=self.source.pk).next_occurrence_start, self.now + datetime.timedelta(days=1, hours=23))
+            self.rule.end_recurring_period = self.now
+            self.rule.save()
+            self.assertIsNone(Event.objects.get(pk=self.source.pk).next_occurrence_checked)
+            self.assertEqual([event.pk for event in Event.objects.update_next_occurrences(now=self.now)], [self.source.pk])
+        self.assertEqual([event.pk for event in Event.objects.due(datetime.timedelta(days=3), now=self.now)], [self.single.pk])
+
+    def test_untracked_changes_reset(self):
+        with self.settings(TRACK_NEXT_OCCURRENCES=False):
+            self.single.start += datetime.timedelta(hours=1)
+            self.single.end += datetime.timedelta(hours=1)
+            self.single.save()
+            Event.objects.filter(pk=self.source.pk).cancel_occurrences(self.now, self.now + datetime.timedelta(days=1))
+        self.assertIsNone(Event.objects.get(pk=self.single.pk).next_occurrence_checked)
+        self.assertIsNone(Event.objects.get(pk=self.source.pk).next_occurrence_checked)
+        self.assertEqual(len(Event.objects.update_next_occurrences(now=self.now)), 2)
+        self.assertEqual(Event.objects.get(pk=self.single.pk).next_occurrence_start, self.single.start)
+        self.assertEqual(Event.objects.get(pk=self.source.pk).next_occurrence_start, self.now + datetime.timedelta(days=1, hours=23))
+
+class TestBulkCreateEvents(TestCase):
+
+    def test_bulk_create_events(self):
+        start = datetime.datetime(2008, 1, 1, 8, 0, tzinfo=timezone.utc)
+        hour = datetime.timedelta(hours=1)
+        day = datetime.timedelta(days=1)
+        existing = Rule.objects.create(frequency="WEEKLY")
+        daily = Rule(frequency="DAILY")
+        events = []
+        for i in range(10):
+            events.append(Event(start=start + i * hour, end=start + (i + 1) * hour, rule=daily))
+            events.append(Event(start=start + i * hour, end=start + (i + 1) * hour, rule_id=existing.pk, cancelled=None))
+            events.append(Event(start=start + i * day, end=start + i * day + hour))
+        moved = Event(start=start + day + hour, end=start + day + 2 * hour, original_start=start + day, original_end=start + day + hour, rule=daily)
+        moved.cancelled = False
+        cancelled = Event(start=start + 2 * day, end=start + 2 * day + hour, rule=daily)
+        cancelled.cancelled = True
+
+        #rules by pk, existing group sources, both rules, inserts.
+        with self.assertNumQueries(6):
+            Event.objects.bulk_create_events(events + [moved, cancelled], batch_size=20)
+
+        self.assertEqual(Event.objects.count(), 32)
+        self.assertEqual(Rule.objects.get(pk=daily.pk).start_recurring_period, start)
+        self.assertEqual(Rule.objects.get(pk=existing.pk).start_recurring_period, start)
+        source = Event.objects.get(rule=daily, start=start, cancelled=None)
+        self.assertEqual((source.original_start, source.original_end), (start, start + hour))
+        self.assertEqual(source.content_type.model_class(), Event)
+        self.assertIsNone(Event.objects.get(rule=daily, start=start + hour, cancelled=None).original_start)
+        cancelled = Event.objects.get(cancelled=True)
+        self.assertEqual((cancelled.original_start, cancelled.original_end), (cancelled.start, cancelled.end))
+        occurrences = source.get_occurrences(start, start + 2 * day + hour)
+        self.assertEqual([(occ.start, occ.cancelled) for occ in occurrences], [(start, False), (start + day + hour, False), (start + 2 * day, True)])
+
+class TestBulkOccurrenceChanges(TestCase):
+
+    def setUp(self):
+        self.start = datetime.datetime(2008, 1, 1, 8, 0, tzinfo=timezone.utc)
+        self.day = datetime.timedelta(days=1)
+        self.rule = Rule.objects.create(frequency="DAILY")
+        self.source = Event.objects.create(start=self.start, end=self.start + datetime.timedelta(hours=1), rule=self.rule)
+        self.source.get_occurrence(self.start + 3 * self.day).cancel()
+        self.moved = self.source.get_occurrence(self.start + 4 * self.day)
+        self.moved.move(self.start + 4 * self.day + datetime.timedelta(hours=2))
+        self.single = Event.objects.create(start=self.start + 2 * self.day, end=self.start + 2 * self.day + datetime.timedelta(hours=1))
+        self.outside = Event.objects.create(start=self.start + 9 * self.day, end=self.start + 9 * self.day + datetime.timedelta(hours=1))
+
+    def occurrences(self):
+        occurrences = self.source.get_occurrences(self.start, self.start + 8 * self.day)
+        return [(occ.start - self.start, occ.cancelled) for occ in occurrences]
+
+    def test_cancel_occurrences(self):
+        #including the leaf class of the source event and resetting the stored next occurrences.
+        with self.assertNumQueries(8):
+            cancelled = Event.objects.all().cancel_occurrences(self.start + 2 * self.day, self.start + 6 * self.day)
+        #the occurrences of day 2, 4 and 5 and the singular event, day 3 was cancelled before.
+        self.assertEqual(cancelled, 4)
+        self.assertEqual([day for day, cancelled in self.occurrences() if cancelled], [2 * self.day, 3 * self.day, 4 * self.day + datetime.timedelta(hours=2), 5 * self.day])
+        self.assertTrue(Event.objects.get(pk=self.single.pk).cancelled)
+        self.assertFalse(Event.objects.get(pk=self.outside.pk).cancelled)
+        self.assertEqual(Event.objects.all().cancel_occurrences(self.start + 2 * self.day, self.start + 6 * self.day), 0)
+
+    def test_shift_occurrences(self):
+        hour = datetime.timedelta(hours=1)
+        shifted = Event.objects.filter(rule=self.rule).shift_occurrences(self.start + 3 * self.day, self.start + 5 * self.day, hour)
+        self.assertEqual(shifted, 2)
+        self.assertEqual(self.occurrences(), [
+            (datetime.timedelta(0), False), (self.day, False), (2 * self.day, False),
+            (3 * self.day + hour, True), (4 * self.day + 3 * hour, False),
+            (5 * self.day, False), (6 * self.day, False), (7 * self.day, False), (8 * self.day, False),
+        ])
+        self.assertEqual(Event.objects.get(pk=self.single.pk).start, self.single.start)
+        self.assertEqual(Event.objects.filter(rule=self.rule).exclude(cancelled=None).count(), 2)
+
+    @override_settings(MATERIALIZE_OCCURRENCES=True, TRACK_NEXT_OCCURRENCES=True)
+    def test_refreshes_denormalized_occurrences(self):
+        from scheduler.models import MaterializedOccurrence
+        now = timezone.now().replace(microsecond=0)
+        source = Event.objects.create(start=now + datetime.timedelta(hours=1), end=now + datetime.timedelta(hours=2), rule=Rule.objects.create(frequency="DAILY"))
+        Event.objects.filter(pk=source.pk).cancel_occurrences(now, now + 2 * self.day)
+        materialized = MaterializedOccurrence.objects.between(now, now + 2 * self.day)
+        self.assertEqual([occurrence.cancelled for occurrence in materialized], [True, True])
+        self.assertEqual(Event.objects.get(pk=source.pk).next_occurrence_start, source.start + 2 * self.day)
@@ -0,0 +1,45 @@
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from scheduler.expansion import expand_calendars
+from scheduler.models import Event, Rule, Calendar
+
+class TestExpandCalendars(TestCase):
+
+    def setUp(self):
+        self.calendars = [Calendar.objects.create(name="Room %i" %i) for i in range(3)]
+        for i, frequency in enumerate(("DAILY", "WEEKLY")):
+            event = Event.objects.create(
+                start=datetime.datetime(2008, 1, 5, 8 + i, 0, tzinfo=timezone.utc),
+                end=datetime.datetime(2008, 1, 5, 9 + i, 0, tzinfo=timezone.utc),
+                rule=Rule.objects.create(frequency=frequency, params="byhour:8,16" if i else None),
+                calendar=self.calendars[i],
+            )
+            event.get_occurrence(datetime.datetime(2008, 1, 12, 8 + i, 0, tzinfo=timezone.utc)).move(
+                datetime.datetime(2008, 1, 13, 7, 0, tzinfo=timezone.utc))
+        for day in (6, 9):
+            Event.objects.create(
+                start=datetime.datetime(2008, 1, day, 10, 0, tzinfo=timezone.utc),
+                end=datetime.datetime(2008, 1, day, 11, 0, tzinfo=timezone.utc),
+                calendar=self.calendars[0],
+            )
+        self.start = datetime.datetime(2008, 1, 3, tzinfo=timezone.utc)
+        self.end = datetime.datetime(2008, 2, 1, tzinfo=timezone.utc)
+
+    def assertSameColumns(self, expanded):
+        self.assertEqual(list(expanded), [calendar.pk for calendar in self.calendars])
+        for calendar in self.calendars:
+            expected = calendar.events.all().occurrence_columns(self.start, self.end).as_dict()
+            self.assertEqual(expanded[calendar.pk].as_dict(), expected)
+
+    def test_in_process(self):
+        with self.assertNumQueries(3):
+            expanded = expand_calendars(self.calendars, self.start, self.end, workers=0)
+        self.assertSameColumns(expanded)
+        self.assertEqual(len(expanded[self.calendars[0].pk]), 29)
+        self.assertEqual(len(expanded[self.calendars[2].pk]), 0)
+
+    def test_process_pool(self):
+        self.assertSameColumns(expand_calendars(self.calendars, self.start, self.end, workers=2))
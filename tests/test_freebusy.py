@@ -0,0 +1,55 @@
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+
+from scheduler.freebusy import get_free_busy, get_calendar_free_busy
+from scheduler.models import Event, Rule, Calendar, EventRelation
+
+def at(day, hour, minute=0):
+    return datetime.datetime(2008, 1, day, hour, minute, tzinfo=timezone.utc)
+
+class TestFreeBusy(TestCase):
+
+    def setUp(self):
+        self.calendar = Calendar.objects.create(name="Room 1")
+        self.other = Calendar.objects.create(name="Room 2")
+        self.empty = Calendar.objects.create(name="Room 3")
+        self.rule = Rule.objects.create(frequency="DAILY")
+        event = Event.objects.create(start=at(5, 8), end=at(5, 10), rule=self.rule, calendar=self.calendar)
+        #overlapping, touching and contained events are merged.
+        Event.objects.create(start=at(7, 9), end=at(7, 11), calendar=self.calendar)
+        Event.objects.create(start=at(7, 11), end=at(7, 12), calendar=self.calendar)
+        Event.objects.create(start=at(7, 14), end=at(7, 15), calendar=self.calendar)
+        Event.objects.create(start=at(7, 14, 15), end=at(7, 14, 45), calendar=self.calendar)
+        Event.objects.create(start=at(7, 13), end=at(7, 16), calendar=self.other)
+        event.get_occurrence(at(8, 8)).cancel()
+        self.start, self.end = at(7, 9, 30), at(8, 12)
+
+    def test_busy_and_free(self):
+        busy, free = get_free_busy(Event.objects.filter(calendar=self.calendar), self.start, self.end)
+        self.assertEqual(busy, [(at(7, 9, 30), at(7, 12)), (at(7, 14), at(7, 15))])
+        self.assertEqual(free, [(at(7, 12), at(7, 14)), (at(7, 15), at(8, 12))])
+
+    def test_shared_rule(self):
+        #sources of the same rule in other calendars aren't busy time,
+        #the rule recurs from the start of its first source.
+        Event.objects.create(start=at(5, 8), end=at(5, 9), rule=self.rule, calendar=self.other)
+        busy, free = get_free_busy(Event.objects.filter(calendar=self.calendar), self.start, self.end)
+        self.assertEqual(busy, [(at(7, 9, 30), at(7, 12)), (at(7, 14), at(7, 15))])
+        free_busy = get_calendar_free_busy([self.calendar, self.other], self.start, self.end)
+        self.assertEqual(free_busy[self.other.pk].busy, [(at(7, 13), at(7, 16)), (at(8, 8), at(8, 9))])
+
+    def test_calendars(self):
+        with self.assertNumQueries(5):
+            free_busy = get_calendar_free_busy([self.calendar, self.other, self.empty.pk], self.start, self.end)
+        self.assertEqual(free_busy[self.calendar.pk].busy, [(at(7, 9, 30), at(7, 12)), (at(7, 14), at(7, 15))])
+        self.assertEqual(free_busy[self.other.pk].busy, [(at(7, 13), at(7, 16))])
+        self.assertEqual(free_busy[self.empty.pk], ([], [(self.start, self.end)]))
+
+    def test_objects(self):
+        owner = Calendar.objects.create(name="Owner")
+        event = Event.objects.create(start=at(7, 10), end=at(7, 11))
+        EventRelation.objects.save_relation(event, owner)
+        busy, free = get_free_busy(Event.objects.get_for_object(owner), self.start, self.end)
+        self.assertEqual(busy, [(at(7, 10), at(7, 11))])
@@ -0,0 +1,77 @@
+import datetime
+import io
+
+from dateutil import rrule
+from django.test import TestCase
+from django.utils import timezone
+
+from scheduler.ical import iter_icalendar, write_icalendar, get_rrule, _fold
+from scheduler.models import Event, Rule, Calendar
+
+def at(day, hour, minute=0):
+    return datetime.datetime(2008, 1, day, hour, minute, tzinfo=timezone.utc)
+
+class TestICalendar(TestCase):
+
+    def setUp(self):
+        self.calendar = Calendar.objects.create(name="Room 1")
+        self.rule = Rule.objects.create(frequency="WEEKLY", params="byweekday:0,2;count:10")
+        self.source = Event.objects.create(start=at(7, 8), end=at(7, 9), rule=self.rule, calendar=self.calendar)
+        self.source.get_occurrence(at(9, 8)).cancel()
+        self.source.get_occurrence(at(14, 8)).move(at(14, 10))
+        self.single = Event.objects.create(start=at(10, 12), end=at(10, 13), calendar=self.calendar)
+        Event.objects.create(start=at(10, 12), end=at(10, 13))
+
+    def export(self, **kwargs):
+        return ''.join(iter_icalendar(Event.objects.filter(calendar=self.calendar), **kwargs))
+
+    def test_export(self):
+        with self.assertNumQueries(5):
+            ical = self.export(properties=lambda event: [('SUMMARY', 'Meeting; room 1, floor 2')])
+        lines = ical.split('\r\n')
+        self.assertEqual(lines[0], 'BEGIN:VCALENDAR')
+        self.assertEqual(lines[-2:], ['END:VCALENDAR', ''])
+        self.assertEqual(lines.count('BEGIN:VEVENT'), 3)
+        self.assertIn('UID:%i@django-essential-scheduler' %self.source.pk, lines)
+        self.assertIn('RRULE:FREQ=WEEKLY;COUNT=10;BYDAY=MO,WE', lines)
+        self.assertIn('EXDATE:20080109T080000Z', lines)
+        self.assertIn('RECURRENCE-ID:20080114T080000Z', lines)
+        self.assertIn('DTSTART:20080114T100000Z', lines)
+        self.assertIn('SUMMARY:Meeting\\; room 1\\, floor 2', lines)
+        self.assertEqual(lines.count('UID:%i@django-essential-scheduler' %self.source.pk), 2)
+
+    def test_rrule_matches_occurrences(self):
+        ical = self.export()
+        master = ical.split('BEGIN:VEVENT\r\n')[1].split('END:VEVENT')[0]
+        expanded = rrule.rrulestr('\n'.join(
+            line for line in master.split('\r\n') if line.split(':')[0] in ('DTSTART', 'RRULE', 'EXDATE')
+        ), forceset=True)
+        occurrences = self.source.get_occurrences(at(1, 0), at(1, 0) + datetime.timedelta(days=60))
+        self.assertEqual(
+            list(expanded),
+            [occ.original_start for occ in occurrences if not occ.cancelled],
+        )
+
+    def test_get_rrule(self):
+        rule = Rule(frequency="MONTHLY", params="interval:2;bymonthday:1,15", end_recurring_period=at(31, 23))
+        self.assertEqual(get_rrule(rule), 'FREQ=MONTHLY;INTERVAL=2;BYMONTHDAY=1,15;UNTIL=20080131T230000Z')
+        with self.assertRaises(ValueError):
+            get_rrule(Rule(frequency="YEARLY", params="byeaster:0"))
+        rule = Rule(frequency="DAILY", params="count:3", end_recurring_period=at(31, 23))
+        self.assertEqual(get_rrule(rule), 'FREQ=DAILY;COUNT=3')
+
+    def test_shared_rule(self):
+        other = Calendar.objects.create(name="Room 2")
+        Event.objects.create(start=at(7, 14), end=at(7, 16), rule=self.rule, calendar=other)
+        ical = self.export()
+        self.assertEqual(ical.count('BEGIN:VEVENT'), 3)
+        self.assertEqual(ical.count('RRULE:'), 1)
+        self.assertIn('RECURRENCE-ID:20080114T080000Z', ical)
+
+    def test_chunks_and_fold(self):
+        out = io.StringIO()
+        write_icalendar(Event.objects.all(), out, chunk_size=1)
+        self.assertEqual(out.getvalue().count('BEGIN:VEVENT'), 4)
+        folded = _fold('DESCRIPTION:' + 'ä' * 40)
+        self.assertTrue(all(len(line.encode('utf-8')) <= 75 for line in folded.split('\r\n')))
+        self.assertEqual(folded.replace('\r\n ', ''), 'DESCRIPTION:' + 'ä' * 40)
@@ -0,0 +1,91 @@
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from scheduler.instrumentation import hot_path, measure, null_measurement
+from scheduler.models import Event, Rule
+from scheduler.periods import Period
+
+class TestInstrumentation(TestCase):
+
+    def setUp(self):
+        self.measurements = []
+        hot_path.connect(self.receive)
+        rule = Rule.objects.create(frequency="WEEKLY")
+        self.event = Event.objects.create(
+            start=datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 5, 9, 0, tzinfo=timezone.utc),
+            rule=rule,
+        )
+        occurrence = self.event.get_occurrence(datetime.datetime(2008, 1, 12, 8, 0, tzinfo=timezone.utc))
+        occurrence.move(occurrence.start + datetime.timedelta(hours=1))
+        self.start = datetime.datetime(2008, 1, 1, tzinfo=timezone.utc)
+        self.end = datetime.datetime(2008, 2, 1, tzinfo=timezone.utc)
+        del self.measurements[:]
+
+    def tearDown(self):
+        hot_path.disconnect(self.receive)
+
+    def receive(self, sender, measurement, **kwargs):
+        self.measurements.append(measurement)
+
+    def find(self, name):
+        return [measurement for measurement in self.measurements if measurement.name == name]
+
+    def test_get_occurrences(self):
+        self.event.get_occurrences(self.start, self.end)
+        measurement, = self.find('get_occurrences')
+        self.assertIs(measurement.sender, Event)
+        self.assertIs(measurement.instance, self.event)
+        self.assertEqual((measurement.generated, measurement.replaced), (4, 1))
+        self.assertEqual(measurement.queries, 1)
+        self.assertGreater(measurement.duration, 0)
+        #weekly rules are expanded without dateutil.
+        self.assertEqual(self.find('get_rrule_object'), [])
+
+    def test_occurrences_after_sent_on_close(self):
+        occurrences = Event.objects.all().occurrences_after(self.start)
+        for i in range(3):
+            next(occurrences)
+        self.assertEqual(self.find('occurrences_after'), [])
+        occurrences.close()
+        measurement, = self.find('occurrences_after')
+        self.assertEqual((measurement.generated, measurement.replaced), (3, 1))
+        self.assertGreater(measurement.queries, 0)
+
+    def test_period(self):
+        Period(Event.objects.source_events(), self.start, self.end).occurrences
+        measurement, = self.find('_get_sorted_occurrences')
+        self.assertEqual(measurement.generated, 4)
+        self.assertEqual(len(self.find('resolve_leaf_classes')), 2)
+
+    def test_query_log_untouched(self):
+        self.assertFalse(connection.force_debug_cursor)
+        self.event.get_occurrences(self.start, self.end)
+        self.assertFalse(connection.force_debug_cursor)
+
+    def test_cursors_restored(self):
+        self.event.get_occurrences(self.start, self.end)
+        self.assertEqual(len(self.find('get_occurrences')), 1)
+        self.assertNotIn('make_cursor', vars(connection))
+        self.assertNotIn('make_debug_cursor', vars(connection))
+
+    def test_queries_counted_with_full_query_log(self):
+        #the log of debug cursors is capped, queries are counted independently.
+        connection.queries_log.extend({} for i in range(connection.queries_log.maxlen))
+        try:
+            with self.settings(DEBUG=True):
+                self.event.get_occurrences(self.start, self.end)
+        finally:
+            connection.queries_log.clear()
+        measurement, = self.find('get_occurrences')
+        self.assertEqual(measurement.queries, 1)
+        self.assertEqual(measurement.using, 'default')
+
+    def test_disabled(self):
+        hot_path.disconnect(self.receive)
+        self.assertIs(measure('get_occurrences', Event), null_measurement)
+        self.event.get_occurrences(self.start, self.end)
+        self.assertEqual(self.measurements, [])
@@ -0,0 +1,72 @@
+import datetime
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from scheduler.models import Event, Rule, Calendar, MaterializedOccurrence
+
+@override_settings(MATERIALIZE_OCCURRENCES=True, MATERIALIZATION_DAYS=30)
+class TestMaterializedOccurrence(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.calendar = Calendar.objects.create(name="MyCal")
+        self.rule = Rule.objects.create(frequency="WEEKLY")
+        self.start = self.now + datetime.timedelta(days=1)
+        self.event = Event.objects.create(
+            start=self.start,
+            end=self.start + datetime.timedelta(hours=1),
+            rule=self.rule,
+            calendar=self.calendar,
+        )
+
+    def test_materialized_on_save(self):
+        rows = MaterializedOccurrence.objects.between(self.now, self.now + datetime.timedelta(days=30), self.calendar)
+        self.assertEqual([row.start for row in rows], [self.start + datetime.timedelta(weeks=i) for i in range(5)])
+        self.assertEqual(
+            [row.as_occurrence().start for row in rows],
+            [occ.start for occ in self.event.get_occurrences(self.now, self.now + datetime.timedelta(days=30))],
+        )
+
+    def test_exceptions_refresh_group(self):
+        occurrence = self.event.get_occurrence(self.start + datetime.timedelta(weeks=1))
+        occurrence.move(occurrence.start + datetime.timedelta(hours=2))
+        self.event.get_occurrence(self.start + datetime.timedelta(weeks=2)).cancel()
+        rows = list(MaterializedOccurrence.objects.between(self.now, self.now + datetime.timedelta(days=30)))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[1].start, self.start + datetime.timedelta(weeks=1, hours=2))
+        self.assertEqual(rows[1].original_start, self.start + datetime.timedelta(weeks=1))
+        self.assertEqual(rows[1].exception_id, rows[1].as_occurrence().pk)
+        self.assertTrue(rows[2].cancelled)
+        self.assertEqual(rows[2].event_id, self.event.pk)
+
+    def test_rule_change_refreshes_rows(self):
+        self.rule.frequency = "DAILY"
+        self.rule.save()
+        self.assertEqual(MaterializedOccurrence.objects.filter(event=self.event).count(), 30)
+
+    def test_singular_event(self):
+        single = Event.objects.create(start=self.start, end=self.start + datetime.timedelta(hours=3))
+        rows = MaterializedOccurrence.objects.filter(event=single)
+        self.assertEqual([(row.start, row.end) for row in rows], [(single.start, single.end)])
+        single.cancel()
+        rows = MaterializedOccurrence.objects.filter(event=single)
+        self.assertEqual([row.cancelled for row in rows], [True])
+        self.assertTrue(rows[0].as_occurrence().cancelled)
+        pk = single.pk
+        single.delete()
+        self.assertFalse(MaterializedOccurrence.objects.filter(event=pk).exists())
+
+    def test_command_moves_horizon(self):
+        MaterializedOccurrence.objects.all().delete()
+        out = StringIO()
+        call_command('materialize_occurrences', stdout=out)
+        self.assertEqual(MaterializedOccurrence.objects.count(), 5)
+        self.assertIn("5 occurrences", out.getvalue())
+
+    @override_settings(MATERIALIZE_OCCURRENCES=False)
+    def test_disabled(self):
+        Event.objects.create(start=self.start, end=self.start + datetime.timedelta(hours=3))
+        self.assertEqual(MaterializedOccurrence.objects.count(), 5)
@@ -5,6 +5,7 @@ from django.utils import timezone
 from django.test import TestCase
 
 from scheduler.models import Event, Rule, Calendar
+from scheduler.models.occurrences import Occurrence
 from scheduler.periods import Period
 from tests.models import *
 
@@ -76,4 +77,35 @@ class TestOccurrence(TestCase):
         self.assertNotEqual(self.recurring_event.get_occurrences(start=self.start, end=self.end)[0],
                             event2.get_occurrences(start=self.start, end=self.end)[1])
         self.assertNotEqual(self.recurring_event.get_occurrences(start=self.start, end=self.end)[0],
-                            event2)
\ No newline at end of file
+                            event2)
+
+    def test_occurrences_are_not_models(self):
+        occurrences = self.recurring_event.get_occurrences(start=self.start, end=self.end)
+        self.assertTrue(all(isinstance(occ, Occurrence) for occ in occurrences))
+        self.assertFalse(hasattr(occurrences[0], '__dict__'))
+        self.assertIs(occurrences[0].source, self.recurring_event)
+        self.assertEqual(occurrences[0].calendar, self.recurring_event.calendar)
+
+    def test_expansion_creates_no_events(self):
+        with self.assertNumQueries(1):
+            occurrences = self.recurring_event.get_occurrences(start=self.start, end=self.end)
+        self.assertEqual(len(occurrences), 3)
+        self.assertTrue(all(occ._event is None for occ in occurrences))
+
+    def test_occurrence_promoted_on_save(self):
+        occurrence = self.recurring_event.get_occurrences(start=self.start, end=self.end)[0]
+        self.assertIsNone(occurrence.pk)
+        occurrence.save()
+        self.assertTrue(occurrence.pk)
+        self.assertNotEqual(occurrence.pk, self.recurring_event.pk)
+        persisted = Event.objects.get(pk=occurrence.pk)
+        self.assertEqual(persisted.original_start, occurrence.original_start)
+        self.assertEqual(persisted.cancelled, False)
+        self.assertEqual(Event.objects.get(pk=self.recurring_event.pk).start, self.recurring_data['start'])
+
+    def test_singular_occurrence_is_its_event(self):
+        event = Event.objects.create(**self.data)
+        occurrence = event.get_occurrences(start=self.data['start'], end=self.data['end'])[0]
+        occurrence.move(occurrence.start + datetime.timedelta(hours=1))
+        self.assertEqual(occurrence.pk, event.pk)
+        self.assertEqual(Event.objects.filter(pk=event.pk)[0].start, self.data['start'] + datetime.timedelta(hours=1))
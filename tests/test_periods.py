@@ -1,13 +1,14 @@
 from django.utils.six.moves.builtins import zip
 from django.utils.six.moves.builtins import range
 import datetime
+import random
 
 from django.test import TestCase
 from django.conf import settings
 from django.utils import timezone
 
 from scheduler.models import Event, Rule, Calendar
-from scheduler.periods import Period, Month, Day, Year, Week
+from scheduler.periods import Period, Month, Day, Year, Week, OccurrencePool, TimeDelta, IntervalIndex, find_conflicts
 
 
 class NewYork(datetime.tzinfo):
@@ -103,6 +104,38 @@ class TestPeriod(TestCase):
         self.assertEqual(len(persisted), 2)
         self.assertTrue(self.period.events[1] in persisted)
 
+    def test_persisted_occurrences_windowed(self):
+        occurrences = self.period.events[0].get_occurrences(
+            start = datetime.datetime(2008, 1, 4, 7, 0, tzinfo=timezone.utc),
+            end = datetime.datetime(2008, 1, 21, 7, 0, tzinfo=timezone.utc)
+        )
+        occurrences[1].cancel()
+        #outside of the period
+        occurrences[0].source.get_occurrence(datetime.datetime(2008, 3, 1, tzinfo=timezone.utc)).cancel()
+        persisted = self.period.get_persisted_occurrences()
+        self.assertEqual(len(persisted), 2)
+        self.assertEqual(len([occ for occ in self.period.occurrences if occ.cancelled]), 1)
+
+    def test_occurrences_query_count(self):
+        cal = Calendar.objects.get(name="MyCal")
+        for i in range(10):
+            rule = Rule(frequency = "DAILY")
+            rule.save()
+            Event(**{
+                'start': datetime.datetime(2008, 1, 5, 8 + i, 0, tzinfo=timezone.utc),
+                'end': datetime.datetime(2008, 1, 5, 8 + i, 30, tzinfo=timezone.utc),
+                'rule': rule,
+                'calendar': cal
+            }).save()
+        events = list(Event.objects.source_events())
+        period = Period(events,
+                        datetime.datetime(2008, 1, 4, 7, 0, tzinfo=timezone.utc),
+                        datetime.datetime(2008, 1, 21, 7, 0, tzinfo=timezone.utc))
+        #persisted occurrences and rules, regardless of the number of events
+        with self.assertNumQueries(2):
+            occurrences = period.occurrences
+        self.assertEqual(len(occurrences), 3 + 10 * 16)
+
 class TestYear(TestCase):
 
     def setUp(self):
@@ -425,4 +458,273 @@ class TestOccurrencePool(TestCase):
         end = datetime.datetime(2008, 1, 5, 10, 0, tzinfo=timezone.utc)
         parent_period = Period(Event.objects.all(), start, end)
         period = Period(parent_period.events, start, end, parent_period.get_persisted_occurrences(), occurrence_pool=parent_period.occurrences)
-        self.assertEqual(parent_period.occurrences, period.occurrences)
\ No newline at end of file
+        self.assertEqual(parent_period.occurrences, period.occurrences)
+
+class TestSharedOccurrencePool(TestCase):
+
+    def setUp(self):
+        rule = Rule(frequency = "DAILY", end_recurring_period=datetime.datetime(2008, 5, 5, 0, 0, tzinfo=timezone.utc))
+        rule.save()
+        data = {
+                'start': datetime.datetime(2008, 1, 5, 23, 0, tzinfo=timezone.utc),
+                'end': datetime.datetime(2008, 1, 6, 1, 0, tzinfo=timezone.utc),
+                'rule': rule,
+               }
+        Event(**data).save()
+        self.events = list(Event.objects.source_events())
+        self.year = Year(events=self.events, date=datetime.datetime(2008, 2, 7, tzinfo=timezone.utc))
+
+    def test_sub_periods_share_pool(self):
+        self.year.occurrences
+        with self.assertNumQueries(0):
+            days = [(day.start, len(day.occurrences)) for day in self.year.get_days]
+        self.assertEqual(len(days), 366)
+        self.assertEqual(days[3][1], 0)
+        #the first occurrence ends on the 6th, the last one starts on the 4th of may.
+        self.assertEqual(days[4][1], 1)
+        self.assertEqual(days[5][1], 2)
+        self.assertEqual(days[124][1], 2)
+        self.assertEqual(days[125][1], 1)
+        self.assertEqual(sum(count for start, count in days), 121 * 2 - 1 + 1)
+
+    def test_pool_matches_direct_computation(self):
+        for day in self.year.get_days:
+            if day.start.day in (5, 6) and day.start.month == 1:
+                direct = Day(self.events, day.start)
+                self.assertEqual(
+                    [(occ.start, occ.end) for occ in direct.occurrences],
+                    [(occ.start, occ.end) for occ in day.occurrences]
+                )
+
+    def test_leading_week_exceptions(self):
+        #the leading week of the month reaches into january.
+        cancelled = datetime.datetime(2008, 1, 30, 23, 0, tzinfo=timezone.utc)
+        self.events[0].get_occurrence(cancelled).cancel()
+        month = Month(self.events, datetime.datetime(2008, 2, 7, tzinfo=timezone.utc))
+        week = next(month.get_weeks)
+        self.assertLess(week.start, cancelled)
+        self.assertEqual(
+            [(occ.start, occ.cancelled) for occ in week.occurrences],
+            [(occ.start, occ.cancelled) for occ in Week(self.events, week.start).occurrences]
+        )
+        self.assertIn((cancelled, True), [(occ.start, occ.cancelled) for occ in week.occurrences])
+
+    def test_pool_between(self):
+        occurrences = self.events[0].get_occurrences(
+            datetime.datetime(2008, 1, 1, tzinfo=timezone.utc),
+            datetime.datetime(2008, 2, 1, tzinfo=timezone.utc)
+        )
+        pool = OccurrencePool(reversed(occurrences))
+        found = pool.between(
+            datetime.datetime(2008, 1, 10, tzinfo=timezone.utc),
+            datetime.datetime(2008, 1, 11, tzinfo=timezone.utc)
+        )
+        self.assertEqual([occ.start.day for occ in found], [9, 10])
+
+class TestTimeDelta(TestCase):
+
+    def test_transpose_days_over_month_end(self):
+        day = TimeDelta(days=1)
+        self.assertEqual(day.transpose(datetime.datetime(2008, 2, 29)), datetime.datetime(2008, 3, 1))
+        self.assertEqual(day.rev().transpose(datetime.datetime(2008, 3, 1)), datetime.datetime(2008, 2, 29))
+
+    def test_transpose_months_clamps_day(self):
+        month = TimeDelta(months=1)
+        self.assertEqual(month.transpose(datetime.datetime(2008, 1, 31)), datetime.datetime(2008, 2, 29))
+        self.assertEqual(month.transpose(datetime.date(2008, 12, 1)), datetime.date(2009, 1, 1))
+        self.assertEqual(month.rev().transpose(datetime.date(2008, 1, 1)), datetime.date(2007, 12, 1))
+
+class Interval(object):
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+class TestIntervalIndex(TestCase):
+
+    def test_overlapping_matches_linear_scan(self):
+        rand = random.Random(5)
+        intervals = []
+        for i in range(200):
+            start = rand.randint(0, 1000)
+            intervals.append(Interval(start, start + rand.choice([0, 1, 5, 30, 400])))
+        index = IntervalIndex(intervals)
+        for i in range(100):
+            start = rand.randint(-50, 1050)
+            end = start + rand.randint(0, 60)
+            expected = sorted(
+                [item for item in intervals if item.start <= end and item.end >= start],
+                key=lambda item: (item.start, intervals.index(item))
+            )
+            self.assertEqual(index.overlapping(start, end), expected)
+
+    def test_empty_index(self):
+        self.assertEqual(IntervalIndex([]).overlapping(0, 10), [])
+
+    def test_foreign_pool_membership(self):
+        rule = Rule(frequency = "WEEKLY")
+        rule.save()
+        other_rule = Rule(frequency = "WEEKLY")
+        other_rule.save()
+        start = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc)
+        member = Event(start=start, end=start + datetime.timedelta(hours=1), rule=rule)
+        member.save()
+        stranger = Event(start=start, end=start + datetime.timedelta(hours=1), rule=other_rule)
+        stranger.save()
+        end = datetime.datetime(2008, 1, 31, tzinfo=timezone.utc)
+        pool = member.get_occurrences(start, end) + stranger.get_occurrences(start, end)
+        period = Period([member], start, end, occurrence_pool=pool)
+        self.assertEqual(len(period.occurrences), 4)
+        self.assertTrue(all(occ.source is member for occ in period.occurrences))
+
+class TestOccurrenceColumns(TestCase):
+
+    def setUp(self):
+        rule = Rule.objects.create(frequency="DAILY", params="interval:2")
+        self.event = Event.objects.create(
+            start=datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 5, 9, 0, tzinfo=timezone.utc),
+            rule=rule,
+        )
+        weekly = Rule.objects.create(frequency="WEEKLY", params="byweekday:1,3")
+        Event.objects.create(
+            start=datetime.datetime(2008, 1, 1, 12, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 1, 14, 0, tzinfo=timezone.utc),
+            rule=weekly,
+        )
+        self.single = Event.objects.create(
+            start=datetime.datetime(2008, 1, 9, 10, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 9, 11, 0, tzinfo=timezone.utc),
+        )
+        self.event.get_occurrence(datetime.datetime(2008, 1, 7, 8, 0, tzinfo=timezone.utc)).move(
+            datetime.datetime(2008, 1, 8, 7, 0, tzinfo=timezone.utc))
+        self.event.get_occurrence(datetime.datetime(2008, 1, 11, 8, 0, tzinfo=timezone.utc)).cancel()
+        self.start = datetime.datetime(2008, 1, 3, tzinfo=timezone.utc)
+        self.end = datetime.datetime(2008, 1, 20, tzinfo=timezone.utc)
+
+    def expected(self, occurrences):
+        #persisted exceptions are reported with the pk of their source event,
+        #singular events are persisted as themselves.
+        sources = dict(Event.objects.filter(cancelled=None).exclude(rule=None).values_list('rule', 'pk'))
+        return sorted((
+            (sources.get(occ.rule_id, occ.group_source.pk), occ.start, occ.end, bool(occ.cancelled), occ.pk or (0 if occ.rule_id else occ.group_source.pk))
+            for occ in occurrences
+        ), key=lambda occ: (occ[1], occ[2]))
+
+    maxDiff = None
+
+    def actual(self, columns):
+        return [
+            (columns.source[i],
+             datetime.datetime.fromtimestamp(columns.start[i], timezone.utc),
+             datetime.datetime.fromtimestamp(columns.end[i], timezone.utc),
+             bool(columns.cancelled[i]),
+             columns.persisted[i])
+            for i in range(len(columns))
+        ]
+
+    def test_period_columns_match_occurrences(self):
+        period = Period(Event.objects.source_events(), self.start, self.end)
+        columns = period.get_occurrence_columns()
+        self.assertEqual(len(columns), 14)
+        self.assertEqual(self.actual(columns), self.expected(period.occurrences))
+        self.assertEqual(list(columns.start), sorted(columns.start))
+
+    def test_queryset_columns_match_occurrences(self):
+        period = Period(Event.objects.source_events(), self.start, self.end)
+        with self.assertNumQueries(4):
+            columns = Event.objects.all().occurrence_columns(self.start, self.end)
+        self.assertEqual(self.actual(columns), self.expected(period.occurrences))
+        self.assertEqual(sorted(columns.as_dict()), ['cancelled', 'end', 'persisted', 'source', 'start'])
+
+class TestIterOccurrences(TestCase):
+
+    def setUp(self):
+        daily = Rule.objects.create(frequency="DAILY", end_recurring_period=datetime.datetime(2008, 1, 25, tzinfo=timezone.utc))
+        event = Event.objects.create(
+            start=datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 5, 9, 0, tzinfo=timezone.utc),
+            rule=daily,
+        )
+        weekly = Rule.objects.create(frequency="WEEKLY", params="byweekday:1,3")
+        Event.objects.create(
+            start=datetime.datetime(2008, 1, 1, 12, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 1, 14, 0, tzinfo=timezone.utc),
+            rule=weekly,
+        )
+        for day in (3, 9, 28):
+            Event.objects.create(
+                start=datetime.datetime(2008, 1, day, 8, 30, tzinfo=timezone.utc),
+                end=datetime.datetime(2008, 1, day, 10, 0, tzinfo=timezone.utc),
+            )
+        #moved into, within and out of the period, cancelled within and outside.
+        event.get_occurrence(datetime.datetime(2008, 1, 6, 8, 0, tzinfo=timezone.utc)).move(
+            datetime.datetime(2008, 1, 12, 7, 0, tzinfo=timezone.utc))
+        event.get_occurrence(datetime.datetime(2008, 1, 8, 8, 0, tzinfo=timezone.utc)).move(
+            datetime.datetime(2008, 2, 8, 7, 0, tzinfo=timezone.utc))
+        event.get_occurrence(datetime.datetime(2008, 1, 10, 8, 0, tzinfo=timezone.utc)).cancel()
+        occurrence = event.get_occurrence(datetime.datetime(2008, 1, 24, 8, 0, tzinfo=timezone.utc))
+        occurrence.move(datetime.datetime(2008, 1, 14, 8, 0, tzinfo=timezone.utc))
+        occurrence.cancel()
+        self.period = Period(Event.objects.source_events(), datetime.datetime(2008, 1, 7, tzinfo=timezone.utc), datetime.datetime(2008, 1, 21, tzinfo=timezone.utc))
+
+    def slots(self, occurrences):
+        return [(occ.start, occ.end, bool(occ.cancelled)) for occ in occurrences]
+
+    def test_same_occurrences_as_list(self):
+        expected = self.slots(Period(self.period.events, self.period.start, self.period.end).occurrences)
+        actual = self.slots(self.period.iter_occurrences())
+        self.assertEqual(sorted(actual), sorted(expected))
+        self.assertEqual([end for start, end, cancelled in actual], sorted(end for start, end, cancelled in expected))
+
+    def test_stop_early(self):
+        occurrences = self.period.iter_occurrences()
+        first = [next(occurrences) for i in range(3)]
+        self.assertEqual(self.slots(first), self.slots(self.period.occurrences[:3]))
+
+    def test_event_iter_occurrences(self):
+        event = Event.objects.get(rule__frequency="DAILY", cancelled=None)
+        start, end = self.period.start, self.period.end
+        self.assertEqual(
+            sorted(self.slots(event.iter_occurrences(start, end))),
+            sorted(self.slots(event.get_occurrences(start, end))),
+        )
+
+class TestConflicts(TestCase):
+
+    def test_find_conflicts(self):
+        a, b, c, d, e = [
+            Interval(start, end)
+            for start, end in [(0, 10), (5, 7), (6, 12), (12, 13), (20, 21)]
+        ]
+        conflicts = find_conflicts([e, d, c, b, a])
+        self.assertEqual(
+            sorted((pair[0].start, pair[1].start) for pair in conflicts),
+            [(0, 5), (0, 6), (5, 6)],
+        )
+        self.assertEqual(find_conflicts([]), [])
+
+    def test_period_conflicts(self):
+        rule = Rule.objects.create(frequency="DAILY")
+        source = Event.objects.create(
+            start=datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 5, 10, 0, tzinfo=timezone.utc),
+            rule=rule,
+        )
+        single = Event.objects.create(
+            start=datetime.datetime(2008, 1, 6, 9, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 6, 11, 0, tzinfo=timezone.utc),
+        )
+        Event.objects.create(
+            start=datetime.datetime(2008, 1, 7, 10, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 7, 11, 0, tzinfo=timezone.utc),
+        )
+        Event.objects.create(
+            start=datetime.datetime(2008, 1, 8, 9, 0, tzinfo=timezone.utc),
+            end=datetime.datetime(2008, 1, 8, 9, 30, tzinfo=timezone.utc),
+        )
+        source.get_occurrence(datetime.datetime(2008, 1, 8, 8, 0, tzinfo=timezone.utc)).cancel()
+        period = Period(Event.objects.source_events(), datetime.datetime(2008, 1, 5, tzinfo=timezone.utc), datetime.datetime(2008, 1, 9, tzinfo=timezone.utc))
+        conflicts = period.get_conflicts()
+        self.assertEqual(len(conflicts), 1)
+        first, second = conflicts[0]
+        self.assertEqual((first.start, second.start), (datetime.datetime(2008, 1, 6, 8, 0, tzinfo=timezone.utc), single.start))
@@ -1,13 +1,74 @@
+import datetime
+
 from django.test import TestCase
+from django.utils import timezone
 
 from scheduler.models import Rule
+from scheduler.models.rules import rrule_cache
 
 class TestPeriod(TestCase):
 
     def setUp(self):
-        pass
+        rrule_cache.clear()
 
     def test_get_params(self):
         rule = Rule(params = "count:1;bysecond:1;byminute:1,2,4,5")
         expected =  {'count': 1, 'byminute': [1, 2, 4, 5], 'bysecond': 1}
         self.assertEqual(rule.get_params(), expected)
+
+    def test_rrule_cache_hit(self):
+        rule = Rule(frequency="DAILY", params="interval:2")
+        rule.save()
+        dtstart = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc)
+        first = rule.get_rrule_object(dtstart)
+        second = Rule.objects.get(pk=rule.pk).get_rrule_object(dtstart)
+        self.assertIs(first, second)
+        self.assertEqual(rrule_cache.info()[:2], (1, 1))
+        #cached rrules don't keep the dates they generated.
+        list(first.xafter(dtstart, count=100))
+        self.assertIsNone(first._cache)
+
+    def test_rrule_cache_invalidated_on_save(self):
+        rule = Rule(frequency="DAILY", params="interval:2")
+        rule.save()
+        dtstart = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc)
+        first = rule.get_rrule_object(dtstart)
+        self.assertEqual(rrule_cache.info().currsize, 1)
+        rule.params = "interval:3"
+        rule.save()
+        self.assertEqual(rrule_cache.info().currsize, 0)
+        second = rule.get_rrule_object(dtstart)
+        self.assertIsNot(first, second)
+        self.assertEqual(second[1], dtstart + datetime.timedelta(days=3))
+
+    def test_unsaved_rule_not_cached(self):
+        rule = Rule(frequency="DAILY")
+        rule.get_rrule_object(datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc))
+        self.assertEqual(rrule_cache.info(), (0, 0, rrule_cache.maxsize, 0))
+
+    def test_between_fixed_step(self):
+        dtstart = datetime.datetime(2008, 1, 5, 8, 0, 30, 500, tzinfo=timezone.utc)
+        after = datetime.datetime(2008, 1, 7, 8, 0, 30, tzinfo=timezone.utc)
+        before = datetime.datetime(2008, 3, 1, tzinfo=timezone.utc)
+        for frequency, params, window in [
+            ("DAILY", None, before), ("DAILY", "interval:2", before), ("WEEKLY", "interval:3", before),
+            ("HOURLY", "interval:7", before), ("DAILY", "count:4;interval:1", before), ("HOURLY", "count:3", before),
+            #shorter windows, dateutil is slow to compare with.
+            ("MINUTELY", None, after + datetime.timedelta(days=1)), ("MINUTELY", "interval:13", after + datetime.timedelta(days=1)),
+            ("SECONDLY", "interval:7", after + datetime.timedelta(hours=1)), ("SECONDLY", "count:10", after),
+        ]:
+            rule = Rule(frequency=frequency, params=params)
+            self.assertIsNotNone(rule.get_fixed_step())
+            self.assertEqual(rule.between(after, window, dtstart), rule.get_rrule_object(dtstart).between(after, window, inc=True))
+            exact = dtstart.replace(microsecond=0)
+            self.assertEqual(rule.between(exact, exact, dtstart), [exact])
+        self.assertEqual(rule.between(before, after, dtstart), [])
+
+    def test_between_falls_back_to_rrule(self):
+        dtstart = datetime.datetime(2008, 1, 5, 8, 0, tzinfo=timezone.utc)
+        after = datetime.datetime(2008, 1, 7, tzinfo=timezone.utc)
+        before = datetime.datetime(2008, 3, 1, tzinfo=timezone.utc)
+        for frequency, params in [("MONTHLY", None), ("WEEKLY", "byweekday:1,3"), ("HOURLY", "byhour:8,9")]:
+            rule = Rule(frequency=frequency, params=params)
+            self.assertIsNone(rule.get_fixed_step())
+            self.assertEqual(rule.between(after, before, dtstart), rule.get_rrule_object(dtstart).between(after, before, inc=True))